@@ -0,0 +1,159 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import subprocess
+import sys
+import time
+from tabulate import tabulate
+from networkinterface import EventNetworkInterface
+from messages import Unicast, Broadcast
+import scheduler
+import simulator
+import spf
+import oracle
+import wireformat
+import topology
+
+# the counters of the benchmark, reset on every measured phase
+class BenchmarkStats:
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.SpfRuns = 0
+        self.SpfSeconds = 0.0
+        self.Messages = 0
+        self.Bytes = 0
+        self.LastChange = None # the scheduler time of the last spf run
+
+# return a subclass of the spf engine which counts and times the runs
+def TimedEngine(engine, stats:BenchmarkStats):
+    class TimedSpf(engine):
+        def Calculate(self, root, link_states:dict, changes=None):
+            started = time.perf_counter()
+            D = engine.Calculate(self, root, link_states, changes)
+            stats.SpfSeconds += time.perf_counter() - started
+            stats.SpfRuns += 1
+            stats.LastChange = scheduler.Now()
+            return D
+    return TimedSpf
+
+# the network interface counting the delivered messages and their size in the wire format,
+# a broadcast counts a datagram per destination as sent by udpnetwork
+class CountingNetworkInterface(EventNetworkInterface):
+    def __init__(self, edges:frozenset, event_scheduler, stats:BenchmarkStats):
+        EventNetworkInterface.__init__(self, edges, event_scheduler)
+        self.__stats = stats
+
+    def sendto(self, msg:Unicast):
+        self.__stats.Messages += 1
+        self.__stats.Bytes += wireformat.EncodedSize(msg)
+        EventNetworkInterface.sendto(self, msg)
+
+    def broadcast(self, message:Broadcast):
+        size = wireformat.EncodedSize(message)
+        self.__stats.Messages += len(message.dests)
+        self.__stats.Bytes += size * len(message.dests)
+        EventNetworkInterface.broadcast(self, message)
+
+def CurrentCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True
+            , text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# run the generated topology on the virtual clock, and measure the start up and
+# every scripted command until the network is refreshed.
+# events: number of links failed and recovered in turn
+# return list of dict, one per measured phase
+# verify: count the routes differing from the oracle after every phase
+def RunBenchmark(generator, size, spf_engine, events, seed=None, verify=False):
+    topology_map = topology.Generators[generator](size, seed)
+    topology.load_map(topology_map)
+    scheduler.Instance = scheduler.DiscreteEventScheduler()
+    stats = BenchmarkStats()
+    edges = topology.static_edges()
+    simulator.network = CountingNetworkInterface(edges, scheduler.Instance, stats)
+    simulator.Initialize(simulator.network, TimedEngine(spf.Engines[spf_engine], stats))
+    results = []
+
+    def measure(event, action):
+        stats.Reset()
+        started = scheduler.Now()
+        wall = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            action()
+        results.append({
+            'generator': generator,
+            'nodes': len(topology_map['nodes']),
+            'links': len(topology_map['links']),
+            'spf': spf_engine,
+            'seed': seed,
+            'event': event,
+            'spf_runs': stats.SpfRuns,
+            'spf_seconds': stats.SpfSeconds,
+            'messages': stats.Messages,
+            'bytes': stats.Bytes,
+            'convergence_seconds': stats.LastChange - started if stats.LastChange is not None else 0.0,
+            'wall_seconds': time.perf_counter() - wall,
+        })
+        if verify:
+            results[-1]['mismatches'] = len(oracle.VerifyRouters(
+                simulator.routerFactory.GetRouters(), simulator.network))
+
+    def startup():
+        for router in simulator.routerFactory.GetRouters():
+            router.recover()
+        scheduler.Instance.RunFor(simulator.RefreshInterval())
+    measure('startup', startup)
+
+    rand = random.Random(seed)
+    links = sorted(tuple(sorted(edge)) for edge in edges)
+    for ip1, ip2 in rand.sample(links, min(events, len(links))):
+        for command in ('fail', 'recover'):
+            text = command + ' ' + ip1 + '-' + ip2
+            measure(text, lambda: simulator.InterpretCommand(text))
+    simulator.network.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convergence benchmark of the dynamic routing')
+    parser.add_argument('--generators', nargs='+', choices=sorted(topology.Generators.keys())
+        , default=['grid'], help='the topology generators')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[16, 100]
+        , help='the number of nodes of the generated topologies, from 10 to 10k')
+    parser.add_argument('--spf', nargs='+', choices=sorted(spf.Engines.keys())
+        , default=[spf.DefaultEngine], help='the shortest path first engines')
+    parser.add_argument('--events', type=int, default=3, help='number of links failed and recovered')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='append the results as JSON lines to the file')
+    parser.add_argument('--verify', action='store_true'
+        , help='compare the forwarding tables with the oracle after every phase')
+    args = parser.parse_args()
+
+    commit = CurrentCommit()
+    output = open(args.output, 'a') if args.output else None
+    rows = []
+    try:
+        for generator in args.generators:
+            for size in args.sizes:
+                for spf_engine in args.spf:
+                    for result in RunBenchmark(generator, size, spf_engine, args.events, args.seed, args.verify):
+                        result['commit'] = commit
+                        if output is not None:
+                            output.write(json.dumps(result) + '\n')
+                            output.flush()
+                        else:
+                            print(json.dumps(result))
+                        rows.append([result['generator'], result['nodes'], result['spf'], result['event']
+                            , result['spf_runs'], format(result['spf_seconds'], '.3f'), result['messages']
+                            , result['bytes'], format(result['convergence_seconds'], '.1f')
+                            , format(result['wall_seconds'], '.3f')] + [result.get('mismatches', '')])
+    finally:
+        if output is not None:
+            output.close()
+    print(tabulate(rows, headers=['topology', 'nodes', 'spf', 'event', 'spf runs', 'spf s'
+        , 'messages', 'bytes', 'converged s', 'wall s', 'mismatches']), file=sys.stderr)
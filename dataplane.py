@@ -0,0 +1,181 @@
+import argparse
+import json
+import math
+import time
+import zlib
+from collections import namedtuple
+from tabulate import tabulate
+import scheduler
+import simulator
+import spf
+import topology
+from networkinterface import EventNetworkInterface
+
+# a flow of user traffic
+# Key: identifies the flow among the flows between the same src and dst, the packets
+# of a flow always take the same path
+Flow = namedtuple('Flow', ['Src', 'Dst', 'Packets', 'Key'])
+
+MaxHops = 64 # the packets are dropped as looping beyond the hops
+
+# read the flows of a traffic matrix file, one json object per line:
+# {"src": "10.0.0.1", "dst": "10.0.0.7", "packets": 100, "flow": 1}
+# packets is 1 and flow is 0 by default. the blank lines and the lines starting with '#' are skipped.
+# yield Flow
+def ReadFlows(file):
+    with open(file, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or 'src' not in record or 'dst' not in record:
+                    raise ValueError('expected a flow {"src", "dst", "packets", "flow"}')
+                packets = record.get('packets', 1)
+                if not isinstance(packets, int) or isinstance(packets, bool) or packets <= 0:
+                    raise ValueError("invalid packets '" + str(packets) + "'")
+                yield Flow(Src=record['src'], Dst=record['dst'], Packets=packets, Key=record.get('flow', 0))
+            except ValueError as e:
+                raise ValueError(file + ':' + str(number) + ': ' + str(e)) from None
+
+# the hash choosing the ECMP next hop of the flow, stable across the processes
+def FlowHash(flow:Flow):
+    return zlib.crc32((flow.Src + '>' + flow.Dst + '>' + str(flow.Key)).encode())
+
+class TrafficReport:
+    def __init__(self, capacity=None):
+        self.Capacity = capacity # packets a link can carry, None to report the share of the traffic
+        self.Flows = 0
+        self.Packets = 0
+        self.Delivered = 0
+        self.Dropped = {} # key: reason; value: packets
+        self.LinkLoads = {} # key: tuple(ip, next hop ip); value: packets
+        self.PacketHops = 0
+        self.Stretches = [] # path cost over the shortest cost of the delivered flows
+        self.Seconds = 0.0
+
+    def Drop(self, reason, packets):
+        self.Dropped[reason] = self.Dropped.get(reason, 0) + packets
+
+    # packets forwarded by a hop per second of wall time
+    def PacketsPerSecond(self):
+        return self.PacketHops / self.Seconds if self.Seconds > 0 else 0.0
+
+    def Utilisation(self, link):
+        if self.Capacity:
+            return self.LinkLoads[link] / self.Capacity
+        return self.LinkLoads[link] / self.Packets if self.Packets else 0.0
+
+    def print_report(self, top=10):
+        summary = [
+            ['flows', str(self.Flows)],
+            ['packets', str(self.Packets)],
+            ['delivered', str(self.Delivered)],
+        ]
+        summary.extend(['dropped (' + reason + ')', str(packets)] for reason, packets in sorted(self.Dropped.items()))
+        if self.Stretches:
+            summary.append(['mean stretch', format(sum(self.Stretches) / len(self.Stretches), '.3f')])
+            summary.append(['max stretch', format(max(self.Stretches), '.3f')])
+        summary.append(['packet hops/s', format(self.PacketsPerSecond(), '.0f')])
+        print(tabulate(summary, disable_numparse=True))
+        links = sorted(self.LinkLoads, key=lambda link: self.LinkLoads[link], reverse=True)[:top]
+        rows = [[link[0] + '->' + link[1], self.LinkLoads[link], format(self.Utilisation(link), '.3f')]
+            for link in links]
+        print(tabulate(rows, headers=['link', 'packets', 'utilisation']))
+
+# the shortest costs from the src over the active routers and the links which are up,
+# the reference of the path stretch
+def __shortest_costs(src, costs:dict, routers:dict, net):
+    link_states = {}
+    for ip, adjacents in costs.items():
+        if not routers[ip].IsActive():
+            continue
+        link_states[ip] = set(topology.AdjacentState(TargetIp=target, Cost=cost)
+            for target, cost in adjacents.items() if target in routers and routers[target].IsActive()
+                and (net is None or net.IsLinkUp(ip, target)))
+    return spf.HeapSpf().Calculate(src, link_states)
+
+# forward the flows hop by hop with the compiled forwarding tables of the routers.
+# the flows are moved in rounds, every round looks up the flows waiting at a
+# router in one batch, and all the packets of a flow are moved together.
+# routers: dict with key as the ip and value as the Router
+# net: the network interface of the link states, None if all the links are up
+# return TrafficReport
+def Forward(routers:dict, flows, net=None, capacity=None):
+    report = TrafficReport(capacity)
+    costs = {ip: {state.TargetIp: state.Cost for state in topology.static_adjacents(ip)} for ip in routers}
+    ordered = {} # the sorted tuple of the next hop set, key: frozenset of next hops
+    shortest = {} # the shortest costs, key: src ip
+    started = time.perf_counter()
+    waiting = {} # key: ip of the router; value: list of [flow, hash, path cost, hops]
+    for flow in flows:
+        report.Flows += 1
+        report.Packets += flow.Packets
+        if flow.Src not in routers:
+            report.Drop('unknown source', flow.Packets)
+            continue
+        if not routers[flow.Src].IsActive():
+            report.Drop('router down', flow.Packets)
+            continue
+        waiting.setdefault(flow.Src, []).append([flow, FlowHash(flow), 0, 0])
+    while waiting:
+        moved = {}
+        for ip, batch in waiting.items():
+            for state, nexthops in zip(batch, routers[ip].lookup_many([state[0].Dst for state in batch])):
+                flow = state[0]
+                if flow.Dst == ip:
+                    report.Delivered += flow.Packets
+                    if state[3] > 0:
+                        if flow.Src not in shortest:
+                            shortest[flow.Src] = __shortest_costs(flow.Src, costs, routers, net)
+                        reference = shortest[flow.Src][ip].Cost
+                        if 0 < reference < math.inf:
+                            report.Stretches.append(state[2] / reference)
+                    continue
+                if not nexthops:
+                    report.Drop('no route', flow.Packets)
+                    continue
+                if state[3] >= MaxHops:
+                    report.Drop('loop', flow.Packets)
+                    continue
+                candidates = ordered.get(nexthops, None)
+                if candidates is None:
+                    candidates = ordered.setdefault(nexthops, tuple(sorted(nexthops)))
+                nexthop = candidates[state[1] % len(candidates)]
+                if nexthop not in routers or (net is not None and not net.IsLinkUp(ip, nexthop)):
+                    report.Drop('link down', flow.Packets)
+                    continue
+                if not routers[nexthop].IsActive():
+                    report.Drop('router down', flow.Packets)
+                    continue
+                link = (ip, nexthop)
+                report.LinkLoads[link] = report.LinkLoads.get(link, 0) + flow.Packets
+                report.PacketHops += flow.Packets
+                state[2] += costs[ip].get(nexthop, 0)
+                state[3] += 1
+                moved.setdefault(nexthop, []).append(state)
+        waiting = moved
+    report.Seconds = time.perf_counter() - started
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Forward the flows of a traffic matrix through the converged routers')
+    parser.add_argument('traffic', help='the traffic matrix, a json object per line {"src", "dst", "packets", "flow"}')
+    parser.add_argument('--topology', default='topology.json'
+        , help='the topology file, .json, .jsonl, .csv or .edges')
+    parser.add_argument('--spf', choices=sorted(spf.Engines.keys()), default=spf.DefaultEngine
+        , help='the shortest path first engine of the routers')
+    parser.add_argument('--capacity', type=int, help='packets a link can carry')
+    parser.add_argument('--top', type=int, default=10, help='number of the busiest links reported')
+    args = parser.parse_args()
+    topology.create_map(args.topology)
+    scheduler.Instance = scheduler.DiscreteEventScheduler()
+    simulator.network = EventNetworkInterface(topology.static_edges(), scheduler.Instance)
+    simulator.Initialize(simulator.network, args.spf)
+    for router in simulator.routerFactory.GetRouters():
+        router.recover()
+    scheduler.Instance.RunFor(simulator.RefreshInterval())
+    routers = {router.ip: router for router in simulator.routerFactory.GetRouters()}
+    Forward(routers, ReadFlows(args.traffic), simulator.network, args.capacity).print_report(args.top)
+    simulator.network.close()
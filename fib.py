@@ -0,0 +1,129 @@
+import math
+import socket
+import struct
+
+# the forwarding information base compiled from the distance map of a spf run.
+# the fib is never modified once it is compiled, a new spf result is compiled
+# into a new fib, so the lookups need no lock.
+class Fib:
+    # hosts: dict with key as the dest ip and value as frozenset of the next hop ips
+    # trie: PrefixTrie of the prefix routes, None if there is no prefix route
+    def __init__(self, hosts:dict, trie=None):
+        self.__hosts = hosts
+        self.__trie = trie
+
+    # return frozenset of the ECMP next hop ips toward the dest ip, None if there is no route.
+    # the host routes are matched first, then the longest prefix
+    def Lookup(self, dest):
+        nexthops = self.__hosts.get(dest, None)
+        if nexthops is None and self.__trie is not None:
+            nexthops = self.__trie.Lookup(IpToInt(dest))
+        return nexthops
+
+    # return list of the next hops of the dests in order, see Lookup
+    def LookupMany(self, dests):
+        get = self.__hosts.get
+        if self.__trie is None:
+            return [get(dest, None) for dest in dests]
+        trie_lookup = self.__trie.Lookup
+        result = []
+        for dest in dests:
+            nexthops = get(dest, None)
+            if nexthops is None:
+                nexthops = trie_lookup(IpToInt(dest))
+            result.append(nexthops)
+        return result
+
+    def __len__(self):
+        return len(self.__hosts)
+
+    # iterate tuple(dest ip, frozenset of the next hop ips) of the host routes
+    def Routes(self):
+        return self.__hosts.items()
+
+# binary radix trie of the IPv4 prefixes, each node is list[child 0, child 1, value]
+class PrefixTrie:
+    def __init__(self):
+        self.__root = [None, None, None]
+
+    # address, length: the prefix as int and the number of its leading bits
+    def Insert(self, address, length, value):
+        node = self.__root
+        for shift in range(31, 31 - length, -1):
+            bit = (address >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = value
+
+    # return the value of the longest prefix matching the address, None if nothing matches
+    def Lookup(self, address):
+        node = self.__root
+        value = node[2]
+        shift = 31
+        while shift >= 0:
+            node = node[(address >> shift) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                value = node[2]
+            shift -= 1
+        return value
+
+def IpToInt(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+# parse the 'a.b.c.d/len' prefix, a plain ip is a /32 prefix
+# return tuple(address as int, length)
+def ParsePrefix(prefix):
+    ip, _, length = prefix.partition('/')
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise ValueError("invalid prefix length '" + prefix + "'")
+    mask = ((1 << length) - 1) << (32 - length)
+    return IpToInt(ip) & mask, length
+
+# resolve the next hops of every reachable dest from the precedents of the distance map.
+# the next hops of a dest are the dest itself if the root is a precedent, otherwise
+# the union of the next hops of its precedents.
+# root: the ip of the calculating router
+# distances: the distance map of spf.Engines, key: dest ip; value: PathLink
+# prefixes: dict with key as the prefix 'a.b.c.d/len' and value as the ip of the
+# node which the prefix is routed to
+# return Fib
+def Compile(root, distances:dict, prefixes=None):
+    nexthops = {} # key: dest ip; value: frozenset of the next hop ips
+    shared = {} # the equal next hop sets are stored once
+    for dest, path in distances.items():
+        if dest in nexthops or dest == root or path.Cost == math.inf:
+            continue
+        stack = [dest]
+        visiting = set() # the dests waiting for the next hops of their precedents
+        while stack:
+            v = stack[-1]
+            if v in nexthops:
+                stack.pop()
+                continue
+            if v not in visiting:
+                visiting.add(v)
+                stack.extend(p for p in distances[v].Precedents
+                    if p != root and p not in nexthops and p not in visiting)
+                continue
+            stack.pop()
+            visiting.discard(v)
+            hops = set()
+            for p in distances[v].Precedents:
+                if p == root:
+                    hops.add(v)
+                else:
+                    hops.update(nexthops.get(p, ()))
+            hops = frozenset(hops)
+            nexthops[v] = shared.setdefault(hops, hops)
+    trie = None
+    if prefixes:
+        trie = PrefixTrie()
+        for prefix, origin in prefixes.items():
+            hops = nexthops.get(origin, None)
+            if hops is not None:
+                trie.Insert(*ParsePrefix(prefix), hops)
+    return Fib(nexthops, trie)
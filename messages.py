@@ -1,31 +1,94 @@
 
-import copy
+import weakref
 
+# the messages are never modified once they are sent, so the same instance can
+# be delivered to many routers or sent again. a changed message is a new instance.
 class Unicast:
+    __slots__ = ('src', 'dest')
+
     def __init__(self, src, dest):
         self.src = src
         self.dest = dest
 
 class Ping(Unicast):
+    __slots__ = ()
+
     def __init__(self, src, dest):
         Unicast.__init__(self, src, dest)
 
 class Pong(Unicast):
+    __slots__ = ()
+
     def __init__(self, src, dest):
         Unicast.__init__(self, src, dest)
 
+# the hello messages created once per pair of the source and the destination
+class HelloPool:
+    def __init__(self):
+        self.__pings = {} # key: tuple(src, dest); value: Ping
+        self.__pongs = {} # key: tuple(src, dest); value: Pong
+
+    def GetPing(self, src, dest):
+        ping = self.__pings.get((src, dest), None)
+        if ping is None:
+            ping = self.__pings.setdefault((src, dest), Ping(src, dest))
+        return ping
+
+    def GetPong(self, src, dest):
+        pong = self.__pongs.get((src, dest), None)
+        if pong is None:
+            pong = self.__pongs.setdefault((src, dest), Pong(src, dest))
+        return pong
+
+# the shared adjacent sets, each is a frozenset of namedtuple{TargetIp, Cost}.
+# key: hash of the set. the entry is dropped once no advertisement or link
+# state database holds the set anymore
+__shared_adjacents = weakref.WeakValueDictionary()
+
+# return the shared instance of the adjacent set, so the equal advertisements
+# held by the routers in the same process are stored only once
+def SharedAdjacents(adjacents):
+    if not isinstance(adjacents, frozenset):
+        adjacents = frozenset(adjacents)
+    key = hash(adjacents)
+    shared = __shared_adjacents.get(key, None)
+    if shared is None:
+        __shared_adjacents[key] = adjacents
+        return adjacents
+    # keep the set unshared on the rare hash collision
+    return shared if shared is adjacents or shared == adjacents else adjacents
+
 class NodeAdjacentsDatabase:
-    # Adjacents: set of namedtuple{TargetIp, Cost}
-    def __init__(self, src_ip, adjacents:set):
+    __slots__ = ('NodeIp', 'Adjacents', 'Sequence', 'Age')
+
+    # Adjacents: set of namedtuple{TargetIp, Cost}, shared by all the holders and never modified
+    # Sequence: assigned by the origin, increased on every new instance of the advertisement
+    # Age: seconds since the origin created the advertisement
+    def __init__(self, src_ip, adjacents:set, sequence=0, age=0):
         self.NodeIp = src_ip
-        self.Adjacents = copy.copy(adjacents)
+        self.Adjacents = SharedAdjacents(adjacents)
+        self.Sequence = sequence
+        self.Age = age
+
+    # return the same advertisement which is older by the seconds
+    def Aged(self, seconds):
+        return NodeAdjacentsDatabase(self.NodeIp, self.Adjacents, self.Sequence, self.Age + seconds)
 
 class Broadcast:
+    __slots__ = ('orgin', 'src', 'dests', 'payload')
+
     # src: source ip
+    # dests: ips of the neighbors to receive the message
     # payload: type of NodeAdjacentDatabase
-    def __init__(self, src, dests, audiences, payload:NodeAdjacentsDatabase):
-        self.orgin = src
+    # orgin: ip of the router which started the flooding, the src by default
+    def __init__(self, src, dests, payload:NodeAdjacentsDatabase, orgin=None):
+        self.orgin = orgin if orgin is not None else src
         self.src = src
         self.dests = dests
         self.payload = payload
-        self.audiences = audiences
\ No newline at end of file
+
+    # return the message relayed by the src to the dests.
+    # seconds: the payload is older by the seconds when it is relayed
+    def Forwarded(self, src, dests, seconds=0):
+        payload = self.payload.Aged(seconds) if seconds else self.payload
+        return Broadcast(src, dests, payload, self.orgin)
\ No newline at end of file
@@ -0,0 +1,139 @@
+import json
+import math
+import threading
+import time
+import scheduler
+
+# the metrics are recorded only while the registry is enabled, the call sites
+# check Instance.Enabled first so a disabled registry costs one attribute read.
+# the updates are not locked, an update racing with another thread may be lost.
+
+class Counter:
+    def __init__(self):
+        self.Value = 0
+
+    def Add(self, value=1):
+        self.Value += value
+
+    def Merge(self, other):
+        self.Value += other.Value
+
+    def Snapshot(self):
+        return self.Value
+
+# the distribution of the recorded values, kept as the count of the values
+# per power of two bucket, so the percentiles are approximated within 2x
+class Histogram:
+    def __init__(self):
+        self.Count = 0
+        self.Sum = 0.0
+        self.Min = math.inf
+        self.Max = -math.inf
+        self.Buckets = {} # key: the exponent e of the bucket [2^(e-1), 2^e); value: count
+
+    def Record(self, value):
+        self.Count += 1
+        self.Sum += value
+        if value < self.Min:
+            self.Min = value
+        if value > self.Max:
+            self.Max = value
+        exponent = math.frexp(value)[1] if value > 0 else None
+        self.Buckets[exponent] = self.Buckets.get(exponent, 0) + 1
+
+    def Merge(self, other):
+        self.Count += other.Count
+        self.Sum += other.Sum
+        self.Min = min(self.Min, other.Min)
+        self.Max = max(self.Max, other.Max)
+        for exponent, count in other.Buckets.items():
+            self.Buckets[exponent] = self.Buckets.get(exponent, 0) + count
+
+    # return the upper bound of the bucket holding the percentile
+    def Percentile(self, percent):
+        rank = self.Count * percent / 100
+        seen = 0
+        for exponent in sorted(self.Buckets, key=lambda e: -math.inf if e is None else e):
+            seen += self.Buckets[exponent]
+            if seen >= rank:
+                return 0 if exponent is None else min(math.ldexp(1, exponent), self.Max)
+        return self.Max
+
+    def Snapshot(self):
+        if self.Count == 0:
+            return {'count': 0}
+        return {
+            'count': self.Count,
+            'sum': self.Sum,
+            'mean': self.Sum / self.Count,
+            'min': self.Min,
+            'max': self.Max,
+            'p50': self.Percentile(50),
+            'p99': self.Percentile(99),
+        }
+
+# the histogram of the elapsed seconds
+class Timer(Histogram):
+    # return the start of the timing to be passed to Stop
+    def Start(self):
+        return time.perf_counter()
+
+    def Stop(self, started):
+        self.Record(time.perf_counter() - started)
+
+class Registry:
+    def __init__(self, enabled=False):
+        self.Enabled = enabled
+        self.__metrics = {} # key: tuple(name, label); value: Counter, Histogram or Timer
+        self.__lock = threading.Lock()
+        self.__dump = None # the FutureCallback of the periodic dump
+
+    def __get(self, kind, name, label):
+        metric = self.__metrics.get((name, label), None)
+        if metric is None:
+            with self.__lock:
+                metric = self.__metrics.setdefault((name, label), kind())
+        return metric
+
+    # label: the ip of the router the metric belongs to, None for the process wide metrics
+    def Counter(self, name, label=None):
+        return self.__get(Counter, name, label)
+
+    def Histogram(self, name, label=None):
+        return self.__get(Histogram, name, label)
+
+    def Timer(self, name, label=None):
+        return self.__get(Timer, name, label)
+
+    # return dict with key as the metric name and value as its snapshot.
+    # label: only the metrics of the label, None to merge the metrics of all the labels
+    def Snapshot(self, label=None):
+        with self.__lock:
+            items = list(self.__metrics.items())
+        merged = {}
+        for (name, metric_label), metric in items:
+            if label is not None and metric_label != label:
+                continue
+            if name not in merged:
+                merged[name] = type(metric)()
+            merged[name].Merge(metric)
+        return {name: merged[name].Snapshot() for name in sorted(merged)}
+
+    def Reset(self):
+        with self.__lock:
+            self.__metrics = {}
+
+    # append the snapshot as a json line to the file on every interval of the scheduler
+    def StartDump(self, file, interval:float):
+        self.StopDump()
+        def dump(state):
+            with open(file, 'a') as f:
+                f.write(json.dumps({'time': scheduler.Now(), 'wall': time.time(), 'metrics': self.Snapshot()}) + '\n')
+        self.__dump = scheduler.Instance.Scheule(dump, None, interval)
+
+    def StopDump(self):
+        if self.__dump is not None:
+            scheduler.Instance.CancelSchedule(self.__dump)
+            self.__dump = None
+
+Instance = Registry()
@@ -1,99 +1,210 @@
 import topology
 import threading
+import metrics
 from queue import Queue, Empty
-from messages import Ping, Pong, Unicast, Broadcast, NodeAdjacentsDatabase
+from messages import Ping, Pong, Unicast, Broadcast, NodeAdjacentsDatabase, HelloPool
+
+# call the callback of the router for the message
+def Dispatch(router, message):
+    if isinstance(message, Ping):
+        router.on_hello(message.src)
+    elif isinstance(message, Pong):
+        router.on_hello_back(message.src)
+    elif isinstance(message, Broadcast):
+        router.on_broadcast_message(message)
+
+MaxBatchSize = 4096 # the messages drained at most in a batch of deliver_many
+
+# the up/down state of a link, shared by the both directions
+class LinkState:
+    def __init__(self, edge:frozenset):
+        self.Edge = edge
+        self.Up = True
 
 class NetworkInterface:
     # edges: frozenset of edges which is a frozenset of the two adjacent nodes
-    def __init__(self, edges:frozenset):
+    # batched: drain the queued messages in bulk and hand every router its messages
+    # in one call, see deliver_many
+    def __init__(self, edges:frozenset, batched=False):
+        self.__batched = batched
+        self.__recorder = None
         self.__message_queue = Queue()
-        self.__linkdatabase = {edge:True for edge in edges}
+        self.__hellos = HelloPool()
+        self.__links = {} # key: ip; value: dict{neighbor ip: LinkState}
+        for edge in edges:
+            if len(edge) != 2:
+                continue
+            ip1, ip2 = edge
+            link = LinkState(edge)
+            self.__links.setdefault(ip1, {})[ip2] = link
+            self.__links.setdefault(ip2, {})[ip1] = link
         self.__nodes = {} # dict with key as the ip and value as the Router object
         self.__thread = None
         self.__process_event = threading.Event()
-        self.__is_opened = False
+        self._is_opened = False # set by open and cleared by close of every subclass, see _check_open
 
     def open(self):
-        self.__is_opened = True
+        self._is_opened = True
         self._thread = threading.Thread(target = self.__process_messages)
         self._thread.daemon = True
         self._thread.start()
 
     def IsOpen(self):
-        return self.__is_opened
+        return self._is_opened
 
     def close(self):
-        self.__is_opened = False
+        self._is_opened = False
         self.__process_event.set()
         self._thread.join()
+
+    # raise RuntimeError if the interface is not opened
+    def _check_open(self):
+        if not self._is_opened:
+            raise RuntimeError("message pipe is closed.")
     
+    # return the LinkState between the two nodes, None if they are not adjacent
+    def link(self, ip1, ip2):
+        links = self.__links.get(ip1, None)
+        if links is None:
+            return None
+        return links.get(ip2, None)
+
+    def IsLinkUp(self, ip1, ip2):
+        link = self.link(ip1, ip2)
+        return link is not None and link.Up
+
     def faillink(self, ip1, ip2):
-        key = frozenset([ip1, ip2])
-        if key in self.__linkdatabase:
-            self.__linkdatabase[key] = False
+        link = self.link(ip1, ip2)
+        if link is not None:
+            link.Up = False
     
     def recoverlink(self, ip1, ip2):
-        key = frozenset([ip1, ip2])
-        if key in self.__linkdatabase:
-            self.__linkdatabase[key] = True
+        link = self.link(ip1, ip2)
+        if link is not None:
+            link.Up = True
 
     def __process_messages(self):
-        while self.__is_opened:
+        while self._is_opened:
             try:
                 self.__process_event.wait(0.1) # timeout 100ms
+                if metrics.Instance.Enabled:
+                    metrics.Instance.Histogram('network.queue_depth').Record(self.__message_queue.qsize())
+                while self.__batched and self.__message_queue.qsize() > 0:
+                    messages = []
+                    while len(messages) < MaxBatchSize and self.__message_queue.qsize() > 0:
+                        messages.append(self.__message_queue.get_nowait())
+                    self.deliver_many(messages)
                 while self.__message_queue.qsize() > 0:
-                    message = self.__message_queue.get_nowait()
-                    if message.src not in self.__nodes:
-                        continue # ignore the messages from unknown source       
-                    if isinstance(message, Unicast):
-                        if frozenset([message.src, message.dest]) not in self.__linkdatabase:
-                            continue
-                        if not self.__linkdatabase[frozenset([message.src, message.dest])]:
-                            continue # link is down
-                        dest = self.__nodes.get(message.dest, None)
-                        if dest is None:
-                            continue # unknown destination, ignore
-                        if isinstance(message, Ping):
-                            dest.on_hello(message.src)
-                        elif isinstance(message, Pong):
-                            dest.on_hello_back(message.src)
-                    elif isinstance(message, Broadcast):
-                        for dest in self.__nodes.values():
-                            if dest.ip in message.dests and \
-                            frozenset([message.src, dest.ip]) in self.__linkdatabase and \
-                            self.__linkdatabase[frozenset([message.src, dest.ip])]:
-                                dest.on_broadcast_message(message)
+                    self.deliver(self.__message_queue.get_nowait())
             except Empty:
                 raise
             finally:
                 self.__process_event.clear()
 
+    # deliver the message to the destination routers over the links which are up
+    def deliver(self, message):
+        for dest in self.__destinations(message):
+            if self.__recorder is not None and dest.IsActive():
+                self.__recorder.Record(message, dest.ip)
+            Dispatch(dest, message)
+
+    # deliver the messages grouped by the destination router, every router gets
+    # its messages in order by one call of on_messages
+    def deliver_many(self, messages):
+        batches = {} # key: the destination Router; value: list of the messages
+        for message in messages:
+            for dest in self.__destinations(message):
+                if self.__recorder is not None and dest.IsActive():
+                    self.__recorder.Record(message, dest.ip)
+                batches.setdefault(dest, []).append(message)
+        if metrics.Instance.Enabled:
+            metrics.Instance.Histogram('network.batch_size').Record(len(messages))
+        for dest, batch in batches.items():
+            if hasattr(dest, 'on_messages'):
+                dest.on_messages(batch)
+            else:
+                for message in batch:
+                    Dispatch(dest, message)
+
+    # record every message delivered to an active router, see replay.Recorder
+    # recorder: the object providing Record(message, ip), None to stop recording
+    def set_recorder(self, recorder):
+        self.__recorder = recorder
+
+    # yield the routers receiving the message over the links which are up
+    def __destinations(self, message):
+        if metrics.Instance.Enabled:
+            metrics.Instance.Counter('network.messages').Add()
+        if message.src not in self.__nodes:
+            return # ignore the messages from unknown source
+        links = self.__links.get(message.src, None)
+        if links is None:
+            return
+        if isinstance(message, Unicast):
+            link = links.get(message.dest, None)
+            if link is None or not link.Up:
+                return # link is down
+            dest = self.__nodes.get(message.dest, None)
+            if dest is not None:
+                yield dest
+        elif isinstance(message, Broadcast):
+            if metrics.Instance.Enabled:
+                metrics.Instance.Histogram('network.broadcast_fanout', message.src).Record(len(message.dests))
+            for ip in message.dests:
+                link = links.get(ip, None)
+                if link is None or not link.Up:
+                    continue
+                dest = self.__nodes.get(ip, None)
+                if dest is not None:
+                    yield dest
+
     def register(self, router):
         self.__nodes[router.ip] = router
 
     def sendhello(self, src_ip, dest_ip):
-        self.sendto(Ping(src_ip, dest_ip))
+        self.sendto(self.__hellos.GetPing(src_ip, dest_ip))
     
     def sendhelloback(self, src_ip, dest_ip):
-        self.sendto(Pong(src_ip, dest_ip))
+        self.sendto(self.__hellos.GetPong(src_ip, dest_ip))
 
     def sendto(self, msg:Unicast):
-        if not self.__is_opened:
-            raise RuntimeError("message pipe is closed.")
+        self._check_open()
         # only the adjacent routers can exchange hello messages
         # otherwise, the hello message is discarded
-        if frozenset([msg.src, msg.dest]) in self.__linkdatabase and \
-        self.__linkdatabase[frozenset([msg.src, msg.dest])]:
+        if self.IsLinkUp(msg.src, msg.dest):
             self.__message_queue.put_nowait(msg)
             self.__process_event.set()
     
     # broadcast message to all the routuers on the connected path
     def broadcast(self, message:Broadcast):
-        if not self.__is_opened:
-            raise RuntimeError("message pipe is closed.")
+        self._check_open()
         self.__message_queue.put_nowait(message)
         self.__process_event.set()
 
+# the network interface delivering the messages as callbacks of the scheduler,
+# either on the event loop of a scheduler.AsyncTickScheduler or at the current
+# virtual time of a scheduler.DiscreteEventScheduler, without any polling delay.
+class EventNetworkInterface(NetworkInterface):
+    # event_scheduler: the scheduler providing Call(function, *args)
+    def __init__(self, edges:frozenset, event_scheduler):
+        NetworkInterface.__init__(self, edges)
+        self.__scheduler = event_scheduler
+
+    def open(self):
+        self._is_opened = True
+
+    def close(self):
+        self._is_opened = False
+
+    def sendto(self, msg:Unicast):
+        self._check_open()
+        if self.IsLinkUp(msg.src, msg.dest):
+            self.__scheduler.Call(self.deliver, msg)
+
+    def broadcast(self, message:Broadcast):
+        self._check_open()
+        self.__scheduler.Call(self.deliver, message)
+
 if __name__ == "__main__":
     topology.create_map()
     net = NetworkInterface(topology.static_edges())
@@ -0,0 +1,130 @@
+import math
+from collections import namedtuple
+import spf
+import topology
+
+# the all pairs shortest paths are computed by scipy if it is installed,
+# otherwise by a heap spf run from every node
+try:
+    import numpy
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import shortest_path
+except ImportError:
+    numpy = None
+
+# a route of a router which differs from the oracle
+# Expected, Actual: PathLink, None if there is no route
+Mismatch = namedtuple('Mismatch', ['RouterIp', 'DestIp', 'Expected', 'Actual'])
+
+def SameCost(cost1, cost2):
+    if cost1 == math.inf or cost2 == math.inf:
+        return cost1 == cost2
+    return math.isclose(cost1, cost2, abs_tol=1e-9)
+
+# the shortest distances and the ECMP precedents between all the pairs of the nodes
+class Oracle:
+    # links: dict with key as the ip and value as dict{target ip: cost} of the links which are up
+    def __init__(self, links:dict):
+        self.__ips = sorted(links)
+        self.__index = {ip: i for i, ip in enumerate(self.__ips)}
+        # the links toward every node, list of tuple(source index, cost) per node index
+        self.__incomings = [[] for _ in self.__ips]
+        for ip, targets in links.items():
+            for target, cost in targets.items():
+                if target in self.__index:
+                    self.__incomings[self.__index[target]].append((self.__index[ip], cost))
+        if numpy is not None and self.__ips:
+            self.__rows = self.__scipy_distances(links)
+        else:
+            self.__rows = self.__heap_distances(links)
+
+    def __scipy_distances(self, links:dict):
+        sources, targets, costs = [], [], []
+        for target, incomings in enumerate(self.__incomings):
+            for source, cost in incomings:
+                sources.append(source)
+                targets.append(target)
+                costs.append(cost)
+        size = len(self.__ips)
+        # the zero costs are kept apart from the missing links of the sparse matrix
+        weights = numpy.array(costs, dtype=float)
+        weights[weights == 0] = numpy.finfo(float).tiny
+        graph = csr_matrix((weights, (sources, targets)), shape=(size, size))
+        distances = shortest_path(graph, method='D', directed=True)
+        distances[distances < 1e-300] = 0
+        return distances
+
+    def __heap_distances(self, links:dict):
+        link_states = {ip: set(topology.AdjacentState(TargetIp=target, Cost=cost)
+            for target, cost in targets.items() if target in self.__index) for ip, targets in links.items()}
+        rows = []
+        for ip in self.__ips:
+            distances = spf.HeapSpf().Calculate(ip, link_states)
+            rows.append([0 if dest == ip else distances[dest].Cost for dest in self.__ips])
+        return rows
+
+    def Ips(self):
+        return self.__ips
+
+    def Distance(self, src, dest):
+        return float(self.__rows[self.__index[src]][self.__index[dest]])
+
+    # return PathLink of the shortest paths from the src to the dest, Precedents is
+    # the set of the ips before the dest on the equal cost shortest paths
+    def Route(self, src, dest):
+        row = self.__rows[self.__index[src]]
+        target = self.__index[dest]
+        cost = float(row[target])
+        precedents = set()
+        if cost != math.inf and src != dest:
+            for source, link_cost in self.__incomings[target]:
+                if SameCost(float(row[source]) + link_cost, cost):
+                    precedents.add(self.__ips[source])
+        return spf.PathLink(Precedents=precedents, Cost=cost)
+
+    # compare the distance map of the router at the src with the oracle
+    # table: dict with key as the dest ip and value as PathLink
+    # return list of Mismatch
+    def Verify(self, src, table:dict):
+        mismatches = []
+        row = self.__rows[self.__index[src]]
+        for target, dest in enumerate(self.__ips):
+            if dest == src:
+                continue
+            actual = table.get(dest, None)
+            if actual is not None and actual.Cost == math.inf:
+                actual = None
+            if row[target] == math.inf:
+                if actual is not None:
+                    mismatches.append(Mismatch(src, dest, None, actual))
+                continue
+            expected = self.Route(src, dest)
+            if actual is None or not SameCost(actual.Cost, expected.Cost) \
+            or set(actual.Precedents) != expected.Precedents:
+                mismatches.append(Mismatch(src, dest, expected, actual))
+        for dest, actual in table.items():
+            if dest not in self.__index and dest != src and actual.Cost != math.inf:
+                mismatches.append(Mismatch(src, dest, None, actual))
+        return mismatches
+
+# return Oracle of the active routers and the links which are up
+# routers: the routers of the network, only the active ones are routed through
+# net: the network interface of the link states, None if all the links are up
+def Build(routers, net=None):
+    active = set(router.ip for router in routers if router.IsActive())
+    links = {}
+    for ip in active:
+        links[ip] = {state.TargetIp: state.Cost for state in topology.static_adjacents(ip)
+            if state.TargetIp in active and (net is None or net.IsLinkUp(ip, state.TargetIp))}
+    return Oracle(links)
+
+# verify the forwarding tables of all the active routers against the oracle
+# return list of Mismatch
+def VerifyRouters(routers, net=None):
+    routers = list(routers)
+    truth = Build(routers, net)
+    mismatches = []
+    for router in routers:
+        if router.IsActive():
+            mismatches.extend(truth.Verify(router.ip, router.forwarding_table()))
+    return mismatches
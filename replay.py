@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import struct
+import threading
+import time
+import zlib
+from tabulate import tabulate
+import metrics
+import scheduler
+import spf
+import topology
+import wireformat
+from messages import Unicast, Broadcast
+from networkinterface import NetworkInterface, Dispatch
+from router import RouterFactoryBuilder
+
+# the log of the messages delivered to the routers. replaying a log
+# feeds the same messages in the same order at the same virtual times to fresh
+# routers, so the router code is measured on a repeatable trace.
+#
+# header:  magic (4s), version (B), written once at the start of the file
+# record:  time of the delivery (d), size of the message (H), the message of
+#          wireformat. a broadcast is recorded with the receiving router as
+#          its only destination. the times never decrease within a log
+
+Magic = b'RLOG'
+Version = 1
+
+HeaderFormat = struct.Struct('!4sB')
+RecordFormat = struct.Struct('!dH')
+
+# records the messages delivered by a network interface, see NetworkInterface.set_recorder
+class Recorder:
+    # file: the log, replaced if it already exists
+    def __init__(self, file):
+        self.__file = open(file, 'wb')
+        self.__file.write(HeaderFormat.pack(Magic, Version))
+        self.__lock = threading.Lock()
+        self.Records = 0
+
+    # append the message delivered to the router of the ip
+    def Record(self, message, ip):
+        if isinstance(message, Broadcast) and len(message.dests) != 1:
+            message = Broadcast(message.src, (ip,), message.payload, message.orgin)
+        data = wireformat.Encode(message)
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(RecordFormat.pack(scheduler.Now(), len(data)))
+            self.__file.write(data)
+            self.Records += 1
+
+    def Close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+# read the records of the log one at a time
+# yield tuple(time, message)
+# raise ValueError if the file is not a log of this version, a record is truncated
+# or a record is earlier than the one before it
+def ReadLog(file):
+    with open(file, 'rb') as f:
+        header = f.read(HeaderFormat.size)
+        if len(header) < HeaderFormat.size or HeaderFormat.unpack(header)[0] != Magic:
+            raise ValueError(file + ': not a message log')
+        version = HeaderFormat.unpack(header)[1]
+        if version != Version:
+            raise ValueError(file + ': unsupported message log version ' + str(version))
+        number = 0
+        last = None
+        while True:
+            record = f.read(RecordFormat.size)
+            if not record:
+                return
+            number += 1
+            if len(record) < RecordFormat.size:
+                raise ValueError(file + ': record ' + str(number) + ': truncated')
+            timestamp, size = RecordFormat.unpack(record)
+            if last is not None and timestamp < last:
+                raise ValueError(file + ': record ' + str(number) + ': earlier than the record before')
+            last = timestamp
+            data = f.read(size)
+            if len(data) < size:
+                raise ValueError(file + ': record ' + str(number) + ': truncated')
+            try:
+                yield timestamp, wireformat.Decode(data)
+            except ValueError as e:
+                raise ValueError(file + ': record ' + str(number) + ': ' + str(e)) from None
+
+# the network interface of the replayed routers, the messages sent by the routers
+# are counted and dropped since the log holds every message they receive
+class ReplayNetworkInterface(NetworkInterface):
+    def __init__(self, edges:frozenset):
+        NetworkInterface.__init__(self, edges)
+        self.Dropped = 0
+
+    def open(self):
+        self._is_opened = True
+
+    def close(self):
+        self._is_opened = False
+
+    def sendto(self, msg:Unicast):
+        self._check_open()
+        self.Dropped += 1
+
+    def broadcast(self, message:Broadcast):
+        self._check_open()
+        self.Dropped += 1
+
+class ReplayReport:
+    def __init__(self):
+        self.Messages = 0
+        self.Dropped = 0 # the messages sent by the replayed routers
+        self.VirtualSeconds = 0.0
+        self.Seconds = 0.0
+        self.Digest = 0 # crc32 of the forwarding tables at the end, equal on the equal replays
+
+    def MessagesPerSecond(self):
+        return self.Messages / self.Seconds if self.Seconds > 0 else 0.0
+
+    def print_report(self):
+        print(tabulate([
+            ['messages', str(self.Messages)],
+            ['dropped sends', str(self.Dropped)],
+            ['virtual seconds', format(self.VirtualSeconds, '.1f')],
+            ['seconds', format(self.Seconds, '.3f')],
+            ['messages/s', format(self.MessagesPerSecond(), '.0f')],
+            ['table digest', format(self.Digest, '08x')],
+        ], disable_numparse=True))
+
+def __digest(routers):
+    digest = 0
+    for router in sorted(routers, key=lambda router: router.ip):
+        for dest, path in sorted(router.forwarding_table().items()):
+            digest = zlib.crc32((router.ip + '>' + dest + ':' + str(path.Cost) + ':'
+                + ','.join(sorted(path.Precedents)) + ';').encode(), digest)
+    return digest
+
+# replay the log to fresh routers of the loaded topology on a virtual clock, as
+# fast as the routers process the messages. scheduler.Instance is replaced by a
+# scheduler.DiscreteEventScheduler starting at the time of the first record.
+# spf_engine: name of the spf engine in spf.Engines, or the class of the engine
+# return ReplayReport
+def Replay(file, spf_engine=spf.DefaultEngine):
+    report = ReplayReport()
+    records = ReadLog(file)
+    first = next(records, None)
+    if first is None:
+        return report
+    scheduler.Instance = scheduler.DiscreteEventScheduler(first[0])
+    net = ReplayNetworkInterface(topology.static_edges())
+    builder = RouterFactoryBuilder(net)
+    builder.SetSpfEngine(spf_engine)
+    for ip in topology.node_ips():
+        builder.AddNode(ip)
+    routerFactory = builder.Build()
+    for router in routerFactory.GetRouters():
+        net.register(router)
+    net.open()
+    for router in routerFactory.GetRouters():
+        router.recover()
+    started = time.perf_counter()
+    for timestamp, message in itertools.chain((first,), records):
+        scheduler.Instance.RunUntil(timestamp)
+        ip = message.dest if isinstance(message, Unicast) else next(iter(message.dests))
+        router = routerFactory.GetRouter(ip)
+        if router is None:
+            raise ValueError(file + ": unknown router '" + ip + "'")
+        Dispatch(router, message)
+        report.Messages += 1
+    report.Seconds = time.perf_counter() - started
+    report.VirtualSeconds = scheduler.Now() - first[0]
+    report.Dropped = net.Dropped
+    report.Digest = __digest(routerFactory.GetRouters())
+    net.close()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a message log recorded by the simulator with --record')
+    parser.add_argument('log', help='the message log')
+    parser.add_argument('--topology', default='topology.json'
+        , help='the topology file the log was recorded on, .json, .jsonl, .csv or .edges')
+    parser.add_argument('--spf', choices=sorted(spf.Engines.keys()), default=spf.DefaultEngine
+        , help='the shortest path first engine of the routers')
+    parser.add_argument('--metrics', action='store_true', help='print the metrics recorded by the replay')
+    args = parser.parse_args()
+    topology.create_map(args.topology)
+    metrics.Instance.Enabled = args.metrics
+    Replay(args.log, args.spf).print_report()
+    if args.metrics:
+        print(tabulate([[name, str(value)] for name, value in metrics.Instance.Snapshot().items()]
+            , headers=['metric', 'value'], disable_numparse=True))
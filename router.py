@@ -1,19 +1,22 @@
-from messages import Broadcast, NodeAdjacentsDatabase
-from collections import namedtuple
+from messages import Broadcast, NodeAdjacentsDatabase, SharedAdjacents
+from collections import namedtuple, OrderedDict
 from networkinterface import NetworkInterface
 from tabulate import tabulate
 import threading
 import topology
-import time
 import scheduler
-import copy
 import math
+import spf
+import fib
+import metrics
 
 class RouterFactory:
-    def __init__(self, nodeips, net:NetworkInterface):
+    # spf_engine: name of the spf engine in spf.Engines, or the class of the engine
+    def __init__(self, nodeips, net:NetworkInterface, spf_engine=spf.DefaultEngine):
         self.__routers = {}
+        engine = spf.Engines[spf_engine] if isinstance(spf_engine, str) else spf_engine
         for ip in nodeips:  
-            self.__routers[ip]=Router(ip,  net, topology.static_adjacents(ip))
+            self.__routers[ip]=Router(ip,  net, topology.static_adjacents(ip), engine)
     
     def GetRouters(self):
         return self.__routers.values()
@@ -25,106 +28,227 @@ class RouterFactoryBuilder:
     def __init__(self, net:NetworkInterface):
         self.__node_ips = []
         self.__net = net
+        self.__spf_engine = spf.DefaultEngine
 
     def AddNode(self, ip):
         self.__node_ips.append(ip)
 
+    # name: name of the spf engine in spf.Engines, or the class of the engine
+    def SetSpfEngine(self, name):
+        if isinstance(name, str) and name not in spf.Engines:
+            raise ValueError("unknown spf engine '" + name + "'")
+        self.__spf_engine = name
+
     def Build(self):
-        return RouterFactory(self.__node_ips, self.__net)
+        return RouterFactory(self.__node_ips, self.__net, self.__spf_engine)
 
 class RouterAdjacentState:
     # state: namedtuple{TargetIp, Cost}
     def __init__(self, state):
         self.State = state
         self.Online = True
-        self.LastPingIn = time.monotonic()
-        self.LastPingOut = time.monotonic()
+        self.LastPingIn = scheduler.Now()
+        self.LastPingOut = scheduler.Now()
     
+    # return True if the adjacent is back online
     def OnPing(self):
-        self.LastPingIn = time.monotonic()
+        self.LastPingIn = scheduler.Now()
+        if self.Online:
+            return False
         self.Online = True
+        return True
+
+    # mark the adjacent offline if no ping is received within the timeout
+    # return True if the adjacent goes offline
+    def Expire(self, timeout):
+        if not self.Online or self.LastPingIn + timeout > scheduler.Now():
+            return False
+        self.Online = False
+        return True
 
     def Ping(self):
-        self.LastPingOut = time.monotonic()
+        self.LastPingOut = scheduler.Now()
 
 class Router:
     # adjacents: set of namedtuple{TargetIp, Cost}
-    def __init__(self, ip:str, net:NetworkInterface, adjacents:set):
+    # spf_engine: the class of the spf engine, see spf.Engines
+    def __init__(self, ip:str, net:NetworkInterface, adjacents:set, spf_engine=spf.HeapSpf):
         self.ip = ip
         self.__activate = False
         self.__net = net
-        self.__link_state_database=LinkStateDatabase()
+        self.__spf = spf_engine()
+        self.__link_state_database=LinkStateDatabase(ip)
         self.__adjacents = {state.TargetIp: RouterAdjacentState(state) for state in adjacents}
-        self.__link_state_database.UpdateLinkState(
-            NodeAdjacentsDatabase(ip, adjacents))
         self.__state_lock = threading.RLock()
-        self.__last_broadcast = time.monotonic()
+        self.__sequence = 0
+        self.__self_advertisement = None
+        self.__adjacents_version = 1 # increased when an adjacent goes online or offline
+        self.__advertised_version = 0 # the version of the adjacents in the self advertisement
+        self.__applied_sequence = 0 # the sequence of the self advertisement in the link state database
+        self.__flooded_sequence = 0
+        self.__seen_advertisements = SeenAdvertisements()
+        self.__update_self_link_state()
+        self.__last_broadcast = scheduler.Now()
+        self.__pending_changes = set() # the changes waiting for the throttled spf run
+        self.__spf_scheduled = False
+        self.__spf_throttle = scheduler.Throttle(
+            scheduler.SpfInitialDelay, scheduler.SpfHoldInterval, scheduler.SpfMaxHoldInterval)
+        self.__lsa_throttle = scheduler.Throttle(
+            scheduler.LsaInitialDelay, scheduler.LsaHoldInterval, scheduler.LsaMaxHoldInterval)
+        self.__flood_limiter = scheduler.RateLimiter(scheduler.FloodRate, scheduler.FloodBurst)
+        self.__flood_queue = OrderedDict() # the relayed messages waiting, key: ip of the origin
+        self.__flood_scheduled = False
         scheduler.Instance.Scheule(self.OnTick, None, 2)
         self.__forwarding_table = {} # distance map, key:dest ip; value: tuple(set(Precedents), Cost)
+        self.__prefixes = {} # the prefix routes, key: prefix 'a.b.c.d/len'; value: ip of the node routed to
+        self.__fib = fib.Fib({}) # compiled from the forwarding table, swapped as a whole
         self.__calculate_forwarding_table()
 
     def OnTick(self, state):
         if not self.__activate:
             return
         for adjacent in self.__adjacents.values():
-            if adjacent.LastPingOut + scheduler.PingInterval <= time.monotonic():
+            if adjacent.LastPingOut + scheduler.PingInterval <= scheduler.Now():
                 self.hello(adjacent.State.TargetIp)
-            if adjacent.LastPingIn + scheduler.PingInterval * 2 <= time.monotonic():
-                adjacent.Online = False
+            if adjacent.Expire(scheduler.PingInterval * 2):
+                self.__adjacents_version += 1
+        with self.__state_lock:
+            changes = self.__update_self_link_state()
+            if changes:
+                self.__schedule_spf(changes)
+        if changes or self.__self_advertisement.Sequence != self.__flooded_sequence:
+            # a paced origination is flooded on a later tick
+            if self.__lsa_throttle.Delay(scheduler.Now()) <= 0:
+                self.broadcast()
+        elif self.__last_broadcast + scheduler.BroadcastInterval <= scheduler.Now():
+            self.broadcast(refresh=True)
+
+    # the advertisement of the online adjacents originated by this router, it is
+    # cached until the online state of an adjacent is changed.
+    # a new sequence is taken only if the online adjacents are changed or refresh is required
+    def __advertisement(self, refresh=False):
+        with self.__state_lock:
+            if not refresh and self.__advertised_version == self.__adjacents_version:
+                return self.__self_advertisement
+            # taken first, so a change racing with the rebuild is seen next time
+            self.__advertised_version = self.__adjacents_version
+            adjacents = set(adjacent.State for adjacent in self.__adjacents.values() if adjacent.Online)
+            if refresh or self.__self_advertisement is None \
+            or adjacents != self.__self_advertisement.Adjacents:
+                self.__sequence += 1
+                self.__self_advertisement = NodeAdjacentsDatabase(self.ip, adjacents, self.__sequence)
+            return self.__self_advertisement
+
+    # apply the self advertisement to the link state database if it is not applied yet
+    # return the set of the changed links
+    def __update_self_link_state(self):
         with self.__state_lock:
-            payload = NodeAdjacentsDatabase(self.ip, set(map(lambda state: state.State
-                , [adjacent for adjacent in self.__adjacents.values() if adjacent.Online])))
-            updated = self.__link_state_database.UpdateLinkState(payload)
-        if updated:
-            self.__calculate_forwarding_table()
-        if updated or \
-        self.__last_broadcast + scheduler.BroadcastInterval <= time.monotonic():
-            self.broadcast()
+            payload = self.__advertisement()
+            if payload.Sequence == self.__applied_sequence:
+                return set()
+            self.__applied_sequence = payload.Sequence
+            return self.__link_state_database.UpdateLinkState(payload)
+
+    # mark the adjacent online on a message from it
+    # return True if the adjacent is back online
+    def __on_adjacent_message(self, adjacent_node:RouterAdjacentState):
+        if not adjacent_node.OnPing():
+            return False
+        self.__adjacents_version += 1
+        return True
 
     # broadcast link state changes.
-    def broadcast(self):
+    # refresh: originate a new instance of the advertisement even if nothing is changed
+    def broadcast(self, refresh=False):
         if not self.__activate:
             return
-        payload = NodeAdjacentsDatabase(self.ip, set(map(lambda state: state.State
-        , [adjacent for adjacent in self.__adjacents.values() if adjacent.Online])))
+        payload = self.__advertisement(refresh)
+        self.__seen_advertisements.Add(payload.NodeIp, payload.Sequence)
         dests = set(self.__adjacents.keys())
-        audiences = dests.copy()
-        audiences.add(self.ip)
-        message = Broadcast(self.ip, dests, audiences, payload) 
+        message = Broadcast(self.ip, dests, payload)
         self.__net.broadcast(message)
+        self.__flooded_sequence = payload.Sequence
+        self.__last_broadcast = scheduler.Now()
+        self.__lsa_throttle.Fired(self.__last_broadcast)
     
         # broadcast link state changes.
     def broadcastmessage(self, message:Broadcast):
         if not self.__activate:
             return
         self.__net.broadcast(message)
-        self.__last_broadcast = time.monotonic()
 
     # callback of a broadcast message
     def on_broadcast_message(self, message:Broadcast):
+        self.on_messages((message,))
+
+    # callback of a batch of the messages to this router, the state lock is taken
+    # once and the changes of all the messages are passed to a single spf schedule
+    # messages: Ping, Pong or Broadcast messages
+    def on_messages(self, messages):
         if not self.__activate:
             return
-        updated = False
+        forwards = []
+        changes = set()
         with self.__state_lock:
-            if message.src != self.ip:
-                payload = NodeAdjacentsDatabase(self.ip, set(map(lambda state: state.State
-                    , [adjacent for adjacent in self.__adjacents.values() if adjacent.Online])))
-                updated |= self.__link_state_database.UpdateLinkState(payload)
-                updated |= self.__link_state_database.UpdateLinkState(message.payload)
+            for message in messages:
+                if message.src == self.ip:
+                    continue
                 adjacent_node = self.__adjacents.get(message.src, None)
                 if adjacent_node is not None:
-                    adjacent_node.OnPing()
-        if updated:
-            self.__calculate_forwarding_table()
-        dests = set(self.__adjacents.keys()) - message.audiences
-        if len(dests) > 0:
-            new_message = copy.copy(message)
-            new_message.src = self.ip
-            new_message.dests = dests
-            new_message.audiences = copy.copy(message.audiences)
-            new_message.audiences |= dests
-            new_message.audiences.add(self.ip)
-            self.broadcastmessage(new_message)
+                    self.__on_adjacent_message(adjacent_node)
+                if not isinstance(message, Broadcast):
+                    continue
+                # the advertisement is already flooded through another path
+                if not self.__seen_advertisements.Add(message.payload.NodeIp, message.payload.Sequence):
+                    continue
+                changed = self.__link_state_database.UpdateLinkState(message.payload)
+                changes |= changed
+                dests = set(ip for ip in self.__adjacents.keys()
+                    if ip != message.src and ip != message.payload.NodeIp)
+                if len(dests) > 0:
+                    forwards.append((message.Forwarded(self.ip, dests, scheduler.TransmitDelay), bool(changed)))
+            changes |= self.__update_self_link_state()
+            if changes:
+                self.__schedule_spf(changes)
+        for message, changed in forwards:
+            self.__flood(message, changed)
+
+    # relay the advertisement, a refresh is paced by the flood limiter, see scheduler.FloodRate
+    # changed: the advertisement changed the link state database, it is relayed at once
+    def __flood(self, message:Broadcast, changed=False):
+        with self.__state_lock:
+            self.__flood_limiter.SetRate(max(scheduler.FloodRate, scheduler.FloodRefreshHeadroom
+                * len(self.__link_state_database.link_states) / scheduler.BroadcastInterval))
+            if changed:
+                # the older instance waiting is superseded
+                self.__flood_queue.pop(message.payload.NodeIp, None)
+                self.__flood_limiter.Take(scheduler.Now())
+                send = True
+            elif not self.__flood_queue and self.__flood_limiter.Take(scheduler.Now()):
+                send = True
+            else:
+                send = False
+                self.__flood_queue[message.payload.NodeIp] = message
+                if self.__flood_scheduled:
+                    return
+                self.__flood_scheduled = True
+                wait = self.__flood_limiter.Wait(scheduler.Now())
+        if send:
+            self.broadcastmessage(message)
+        else:
+            scheduler.Instance.ScheduleOnce(self.__on_flood_timer, None, wait)
+
+    def __on_flood_timer(self, state):
+        messages = []
+        with self.__state_lock:
+            while self.__flood_queue and self.__flood_limiter.Take(scheduler.Now()):
+                messages.append(self.__flood_queue.popitem(last=False)[1])
+            self.__flood_scheduled = bool(self.__flood_queue)
+            wait = self.__flood_limiter.Wait(scheduler.Now())
+        for message in messages:
+            self.broadcastmessage(message)
+        if self.__flood_scheduled:
+            scheduler.Instance.ScheduleOnce(self.__on_flood_timer, None, wait)
 
     # send a hello message to the neighbor
     #receiver: the destination ip
@@ -142,13 +266,14 @@ class Router:
             return
         adjacent_node = self.__adjacents.get(sender, None)
         if adjacent_node is not None:
-            adjacent_node.OnPing()
+            back_online = self.__on_adjacent_message(adjacent_node)
             self.on_hello_back(adjacent_node)
-            payload = NodeAdjacentsDatabase(self.ip, set(map(lambda state: state.State
-                , [adjacent for adjacent in self.__adjacents.values() if adjacent.Online])))
-            updated = self.__link_state_database.UpdateLinkState(payload)
-            if updated:
-                self.__calculate_forwarding_table()
+            # the hellos of an online adjacent change nothing
+            if back_online:
+                with self.__state_lock:
+                    changes = self.__update_self_link_state()
+                    if changes:
+                        self.__schedule_spf(changes)
     
     # send a hello back message to the neighbor
     #receiver: the destination ip
@@ -166,98 +291,215 @@ class Router:
             return
         adjacent_node = self.__adjacents.get(sender, None)
         if adjacent_node is not None:
-            adjacent_node.OnPing()
-            payload = NodeAdjacentsDatabase(self.ip, set(map(lambda state: state.State
-                , [adjacent for adjacent in self.__adjacents.values() if adjacent.Online])))
-            updated = self.__link_state_database.UpdateLinkState(payload)
-            if updated:
-                self.__calculate_forwarding_table()
+            # the hellos of an online adjacent change nothing
+            if self.__on_adjacent_message(adjacent_node):
+                with self.__state_lock:
+                    changes = self.__update_self_link_state()
+                    if changes:
+                        self.__schedule_spf(changes)
     
     def fail(self):
         self.__activate = False
 
+    def IsActive(self):
+        return self.__activate
+
     def recover(self):
         if not self.__activate:
             self.__activate = True
-            self.broadcast()
+            self.broadcast(refresh=True)
 
-    # Dijsktra’s Algorithm with multi path routing
-    def __calculate_forwarding_table(self):
-        N = set([self.ip])
-        D = {} # distance map, key:dest ip; value: tuple(set(Precedents), Cost)
-        PathLink = namedtuple('PathLink', ['Precedents', 'Cost'])
+    # run the spf on the changes throttled with exponential backoff, the changes
+    # arriving before the run are coalesced into it, see scheduler.SpfInitialDelay
+    def __schedule_spf(self, changes):
         with self.__state_lock:
-            # Initialize the distance map
-            for v in self.__link_state_database.link_states:
-                if v == self.ip:
-                    continue
-                if v in self.__adjacents and self.__adjacents[v].Online:
-                    D[v] =  PathLink(
-                        Precedents = set([self.ip]),
-                        Cost = self.__adjacents[v].State.Cost)
-                else:
-                    D[v] = PathLink(
-                        Precedents = set(),
-                        Cost = math.inf)
-            
-            while len(N) < len(self.__link_state_database.link_states):
-                w = None
-                for v in self.__link_state_database.link_states:
-                    if v in N:
-                        continue;
-                    if w is None:
-                        w = v
-                    elif D[w].Cost > D[v].Cost:
-                        w = v
-                N.add(w)
-                for v in self.__link_state_database.link_states[w]:
-                    if v.TargetIp in N:
-                        continue
-                    if D[v.TargetIp].Cost > D[w].Cost + v.Cost:
-                        D[v.TargetIp] = PathLink(
-                            Precedents =  set([w]),
-                            Cost = D[w].Cost + v.Cost)
-                    elif D[v.TargetIp].Cost == D[w].Cost + v.Cost:
-                        D[v.TargetIp].Precedents.add(w)
-        self.__forwarding_table = D 
+            self.__pending_changes |= changes
+            if self.__spf_scheduled:
+                return
+            delay = self.__spf_throttle.Delay(scheduler.Now())
+            if delay <= 0:
+                self.__run_pending_spf()
+                return
+            self.__spf_scheduled = True
+        scheduler.Instance.ScheduleOnce(self.__on_spf_timer, None, delay)
+
+    def __on_spf_timer(self, state):
+        with self.__state_lock:
+            self.__spf_scheduled = False
+            self.__run_pending_spf()
+
+    def __run_pending_spf(self):
+        changes = self.__pending_changes
+        self.__pending_changes = set()
+        self.__spf_throttle.Fired(scheduler.Now())
+        self.__calculate_forwarding_table(changes)
+
+    # Dijsktra’s Algorithm with multi path routing, see spf.Engines
+    # changes: the links changed since the last calculation, None for a full calculation
+    def __calculate_forwarding_table(self, changes=None):
+        with self.__state_lock:
+            timer = metrics.Instance.Timer('spf.seconds', self.ip) if metrics.Instance.Enabled else None
+            if timer is not None:
+                started = timer.Start()
+            D = self.__spf.Calculate(self.ip, self.__link_state_database.link_states, changes)
+            self.__forwarding_table = D 
+            self.__fib = fib.Compile(self.ip, D, self.__prefixes)
+            if timer is not None:
+                timer.Stop(started)
+                if changes is not None:
+                    metrics.Instance.Histogram('spf.changes', self.ip).Record(len(changes))
+
+    # route the prefix 'a.b.c.d/len' toward the node of the ip
+    def add_prefix(self, prefix, ip):
+        fib.ParsePrefix(prefix)
+        with self.__state_lock:
+            self.__prefixes[prefix] = ip
+            self.__fib = fib.Compile(self.ip, self.__forwarding_table, self.__prefixes)
+
+    # return frozenset of the ECMP next hop ips toward the dest ip, None if there is no route.
+    # the lookup reads the latest compiled fib without taking the state lock
+    def lookup(self, dest):
+        return self.__fib.Lookup(dest)
+
+    # return list of the next hops of the dests in order, see lookup
+    def lookup_many(self, dests):
+        return self.__fib.LookupMany(dests)
+
+    # return a copy of the distance map, key: dest ip; value: PathLink
+    def forwarding_table(self):
+        with self.__state_lock:
+            return {dest: spf.PathLink(Precedents=set(path.Precedents), Cost=path.Cost)
+                for dest, path in self.__forwarding_table.items()}
+
+    # return the version of the link state database, None while an spf run, a relayed
+    # flood or an origination is pending. the router is settled once the version
+    # stays the same, see simulator.WaitForConvergence
+    def convergence_state(self):
+        with self.__state_lock:
+            if self.__spf_scheduled or self.__pending_changes or self.__flood_scheduled \
+            or self.__self_advertisement.Sequence != self.__flooded_sequence:
+                return None
+            return self.__link_state_database.version
+
+    # return RouterSnapshot of the state, see snapshot.Save
+    def snapshot(self):
+        with self.__state_lock:
+            database = self.__link_state_database
+            return RouterSnapshot(Ip=self.ip, Active=self.__activate, Sequence=self.__sequence
+                , Online=frozenset(ip for ip, adjacent in self.__adjacents.items() if adjacent.Online)
+                , LinkStates={ip: (database.sequences.get(ip, 0), adjacents)
+                    for ip, adjacents in database.link_states.items()}
+                , Table=self.forwarding_table())
+
+    # restore the state of the RouterSnapshot as converged, nothing is flooded or
+    # recalculated until the next change. the online adjacents are taken as just
+    # heard from, and the router is activated if it was active.
+    def restore(self, state):
+        with self.__state_lock:
+            database = LinkStateDatabase(self.ip)
+            seen = SeenAdvertisements()
+            for ip, (sequence, adjacents) in state.LinkStates.items():
+                database.link_states[ip] = SharedAdjacents(adjacents)
+                if sequence > 0:
+                    database.sequences[ip] = sequence
+                    seen.Add(ip, sequence)
+            self.__link_state_database = database
+            self.__seen_advertisements = seen
+            for ip, adjacent in self.__adjacents.items():
+                adjacent.Online = ip in state.Online
+                adjacent.LastPingIn = scheduler.Now()
+            self.__sequence = state.Sequence
+            self.__self_advertisement = NodeAdjacentsDatabase(self.ip
+                , set(adjacent.State for adjacent in self.__adjacents.values() if adjacent.Online), state.Sequence)
+            self.__adjacents_version += 1
+            self.__advertised_version = self.__adjacents_version
+            self.__applied_sequence = state.Sequence
+            self.__flooded_sequence = state.Sequence
+            self.__last_broadcast = scheduler.Now()
+            self.__pending_changes = set()
+            # the engine state of the previous tables is stale
+            self.__spf = type(self.__spf)()
+            self.__forwarding_table = {dest: spf.PathLink(Precedents=set(path.Precedents), Cost=path.Cost)
+                for dest, path in state.Table.items()}
+            self.__fib = fib.Compile(self.ip, self.__forwarding_table, self.__prefixes)
+            self.__activate = state.Active
 
     def print_forwardtable(self):
         forwardlist = []
-        for k, v in self.__forwarding_table.items():
-            if k == self.ip:
-                continue
-            if v.Cost == math.inf:
-                continue
-            row = [k]
-            row.append(list(v.Precedents))
-            row.append(v.Cost)
-            forwardlist.append(row)
+        with self.__state_lock:
+            for k, v in self.__forwarding_table.items():
+                if k == self.ip:
+                    continue
+                if v.Cost == math.inf:
+                    continue
+                row = [k]
+                row.append(list(v.Precedents))
+                row.append(v.Cost)
+                forwardlist.append(row)
         table = tabulate(forwardlist, headers=['dest', 'precedents', 'cost'])
         print(table)
 
+# The highest sequence of the advertisements flooded by the router per origin,
+# an advertisement is seen if its sequence is not newer than the recorded one
+class SeenAdvertisements:
+    def __init__(self):
+        self.__sequences = {} # key: the ip of the origin; value: the highest sequence seen
+
+    # return True if the advertisement is not seen before
+    def Add(self, origin, sequence):
+        if sequence <= self.__sequences.get(origin, -1):
+            return False
+        self.__sequences[origin] = sequence
+        return True
+
+AdjacentLink = namedtuple('AdjacentLink', ['TargetIp', 'Cost'])
+
+# the state of a router saved by Router.snapshot
+# Online: frozenset of the ips of the online adjacents
+# LinkStates: dict with key as the node ip and value as tuple(sequence, adjacents) of the
+# link state database, the sequence is 0 if no advertisement of the node is accepted
+# Table: the distance map, key: dest ip; value: PathLink
+RouterSnapshot = namedtuple('RouterSnapshot', ['Ip', 'Active', 'Sequence', 'Online', 'LinkStates', 'Table'])
+
 # The link state database maintained by per router
 class LinkStateDatabase:
-    def __init__(self):
-        self.link_states = {} # key: the ip of node; value: set of namedtuple{TargetIp, Cost}
+    # ip: the ip of the router, the label of the metrics
+    def __init__(self, ip=None):
+        self.ip = ip
+        # key: the ip of node; value: the shared set of namedtuple{TargetIp, Cost}, see messages.SharedAdjacents
+        self.link_states = {}
+        self.sequences = {} # key: the ip of node; value: the sequence of the accepted advertisement
+        self.version = 0 # increased on every accepted advertisement which changes a link
 
+    # return the set of the changed links, each is a tuple(NodeIp, TargetIp).
+    # the set is empty if nothing is changed, or the advertisement is a duplicate,
+    # older than the accepted one or aged out.
     def UpdateLinkState(self, node_data:NodeAdjacentsDatabase):
-        AdjacentLink = namedtuple('AdjacentLink', ['TargetIp', 'Cost'])
+        changes = set()
+        sequence = self.sequences.get(node_data.NodeIp, None)
+        if sequence is not None and node_data.Sequence <= sequence \
+        or node_data.Age >= scheduler.MaxAge:
+            if metrics.Instance.Enabled:
+                metrics.Instance.Counter('lsdb.rejected', self.ip).Add()
+            return changes
+        self.sequences[node_data.NodeIp] = node_data.Sequence
+        adjacents = SharedAdjacents(node_data.Adjacents)
         if node_data.NodeIp not in self.link_states:
-            self.link_states[node_data.NodeIp] = node_data.Adjacents
-            for node in node_data.Adjacents:
-                if node.TargetIp not in self.link_states:
-                    self.link_states[node.TargetIp] = set(
-                        [AdjacentLink(TargetIp=node_data.NodeIp, Cost=node.Cost)])
-            return True
-
-        linktates = self.link_states[node_data.NodeIp]
+            diff = adjacents
+        else:
+            linktates = self.link_states[node_data.NodeIp]
+            diff = linktates ^ adjacents if linktates is not adjacents else ()
         # only update is there is changes
-        diff = linktates ^ node_data.Adjacents
-        if len(diff) > 0 :
-            self.link_states[node_data.NodeIp] = node_data.Adjacents
-            for node in node_data.Adjacents:
+        if node_data.NodeIp not in self.link_states or len(diff) > 0:
+            self.link_states[node_data.NodeIp] = adjacents
+            self.version += 1
+            changes.update((node_data.NodeIp, node.TargetIp) for node in diff)
+            for node in adjacents:
                 if node.TargetIp not in self.link_states:
-                    self.link_states[node.TargetIp] = set(
+                    self.link_states[node.TargetIp] = SharedAdjacents(
                         [AdjacentLink(TargetIp=node_data.NodeIp, Cost=node.Cost)])
-            return True
-        return False
+                    changes.add((node.TargetIp, node_data.NodeIp))
+        if metrics.Instance.Enabled:
+            metrics.Instance.Counter('lsdb.accepted', self.ip).Add()
+            metrics.Instance.Histogram('lsdb.changes', self.ip).Record(len(changes))
+        return changes
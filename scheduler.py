@@ -1,70 +1,370 @@
-import threading, time
+import threading, time, heapq, itertools, asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
 
 PingInterval = float(5) # 5 seconds
 BroadcastInterval = float(10)
+TransmitDelay = float(1) # age added to an advertisement on every hop
+MaxAge = float(3600) # advertisements of this age are discarded
+
+# the spf runs are throttled with exponential backoff: the first run after a quiet
+# period waits SpfInitialDelay to coalesce a burst of changes, every following run
+# waits the hold interval which doubles up to SpfMaxHoldInterval. the backoff is
+# reset after a quiet period of SpfMaxHoldInterval. 0 delays run the spf at once.
+SpfInitialDelay = float(0.05)
+SpfHoldInterval = float(1)
+SpfMaxHoldInterval = float(8)
+# the origination of the advertisements of a router is throttled the same way
+LsaInitialDelay = float(0)
+LsaHoldInterval = float(1)
+LsaMaxHoldInterval = float(8)
+# the refreshed advertisements relayed by a router are paced by a token bucket, the
+# older instance of an advertisement waiting to be relayed is replaced by the newer
+# one. the changed advertisements are relayed at once, never behind the refreshes.
+# the rate is raised to FloodRefreshHeadroom times the refreshes of all the known
+# origins per BroadcastInterval, so the refreshes never outgrow the bucket.
+FloodRate = float(100) # the least relayed advertisements per second
+FloodBurst = 32
+FloodRefreshHeadroom = float(2)
 
 class FutureCallback:
-    def __init__(self, callback:None, interval:float, state:None):
+    # repeat: call back on every interval, otherwise only once
+    def __init__(self, callback:None, interval:float, state:None, repeat=True):
         self.Callback = callback
         self.Interval = interval
         self.State = state
+        self.Repeat = repeat
+        self.Cancelled = False
+        self.Running = False
+        self.Handle = None # the timer handle of the event loop, used by AsyncTickScheduler
 
-class TickScheduler:
+# The schedules of every callback, shared by the schedulers so a callback can be
+# cancelled on all its schedules. The subclasses lock around the calls if they
+# are made from several threads.
+class CallbackRegistry:
     def __init__(self):
+        self.__callbacks = {} # key: callback; value: set of FutureCallback
+
+    def _Register(self, future:FutureCallback):
+        self.__callbacks.setdefault(future.Callback, set()).add(future)
+
+    # drop the future which will not be called again
+    def _Forget(self, future:FutureCallback):
+        futures = self.__callbacks.get(future.Callback, None)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                self.__callbacks.pop(future.Callback)
+
+    # mark the schedules of the callback cancelled, see CancelSchedule
+    # return the cancelled FutureCallbacks
+    def _Cancel(self, callback:None):
+        if isinstance(callback, FutureCallback):
+            futures = [callback]
+            self._Forget(callback)
+        else:
+            futures = self.__callbacks.pop(callback, set())
+        for future in futures:
+            future.Cancelled = True
+        return futures
+
+# Periodic callbacks ordered by the due time on a binary heap, O(log n) to
+# schedule and O(1) to cancel, the cancelled entries are dropped when popped.
+class TickScheduler(CallbackRegistry):
+    # workers: number of threads running the callbacks, 0 to run them on the scheduler thread
+    def __init__(self, workers=0):
+        CallbackRegistry.__init__(self)
         self.__schedule_thread = threading.Thread(target=self.__TickCallback)
         self.__schedule_thread.daemon = True
         self.__running = False
         self.__schedule_signal = threading.Event()
-        self.__callbacks = {}
+        self.__timers = [] # heap of tuple(timestamp, order, FutureCallback)
+        self.__order = itertools.count()
         self.__callbacks_lock = threading.RLock()
+        self.__workers = workers
+        self.__executor = None
    
+    # the clock of the scheduled callbacks, in fractional seconds
+    def Now(self):
+        return time.monotonic()
+
     def Start(self):
+        if self.__workers > 0:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='tick')
         self.__running = True
         self.__schedule_thread.start()
     
+    # the tick thread is joined before the executor is shut down, so no callback
+    # is submitted to a shut down executor
     def Stop(self):
         self.__running = False
         self.__schedule_signal.set()
+        if self.__schedule_thread.is_alive() and self.__schedule_thread is not threading.current_thread():
+            self.__schedule_thread.join()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
     
     def __TickCallback(self):
         while self.__running:
+            self.__schedule_signal.clear()
+            due = []
             with self.__callbacks_lock:
                 currenttick = time.monotonic()
-                futurestamp = currenttick
-                for nexttick in [key for key in self.__callbacks.keys() if key <= currenttick]:
-                    for futurecall in self.__callbacks.pop(nexttick):
-                        futurecall.Callback(futurecall.State)
-                        self.Scheule(futurecall.Callback, futurecall.State, futurecall.Interval)
-                futurestamp = min(self.__callbacks.keys(), default=-1)
+                while self.__timers and self.__timers[0][0] <= currenttick:
+                    timestamp, _, future = heapq.heappop(self.__timers)
+                    if future.Cancelled:
+                        continue
+                    if metrics.Instance.Enabled:
+                        metrics.Instance.Histogram('scheduler.lateness').Record(currenttick - timestamp)
+                    due.append(future)
+                    if not future.Repeat:
+                        self._Forget(future)
+                        continue
+                    # keep the pace of the callback unless it is behind for a whole interval
+                    nexttick = timestamp + future.Interval
+                    if nexttick <= currenttick:
+                        nexttick = currenttick + future.Interval
+                    heapq.heappush(self.__timers, (nexttick, next(self.__order), future))
+                futurestamp = self.__timers[0][0] if self.__timers else None
+            timer = metrics.Instance.Timer('scheduler.tick_seconds') if metrics.Instance.Enabled and due else None
+            if timer is not None:
+                started = timer.Start()
+            for future in due:
+                self.__Invoke(future)
+            if timer is not None:
+                timer.Stop(started)
             currenttick = time.monotonic()
-            self.__schedule_signal.wait(futurestamp-currenttick if futurestamp-currenttick> 0 else float(500))
-            self.__schedule_signal.clear()
+            if futurestamp is None:
+                self.__schedule_signal.wait(float(500))
+            elif futurestamp > currenttick:
+                self.__schedule_signal.wait(futurestamp-currenttick)
+
+    # run the callback on the executor if any. a callback still running
+    # from the previous tick is skipped, so a slow callback cannot pile up.
+    def __Invoke(self, future:FutureCallback):
+        if self.__executor is None:
+            future.Callback(future.State)
+            return
+        if future.Running:
+            return
+        future.Running = True
+        def run():
+            try:
+                future.Callback(future.State)
+            finally:
+                future.Running = False
+        self.__executor.submit(run)
 
     # callback: function
     # interval: in fractional seconds
+    # return the FutureCallback which can be passed to CancelSchedule
     def Scheule(self, callback:None, state:None, interval:float):
+        return self.__Add(FutureCallback(callback, interval, state))
+
+    # call back only once after the delay in fractional seconds
+    def ScheduleOnce(self, callback:None, state:None, delay:float):
+        return self.__Add(FutureCallback(callback, delay, state, repeat=False))
+
+    def __Add(self, future:FutureCallback):
         with self.__callbacks_lock:
-            # take precision to 100ms
-            timestamp = round(time.monotonic()+interval, 1)
-            callbacks:list = self.__callbacks.get(timestamp, None)
-            future = FutureCallback(callback, interval, state)
-            if callbacks is None:
-                callbacks = [future]
-                self.__callbacks[timestamp] = callbacks
-            else:
-                callbacks.append(future)
+            heapq.heappush(self.__timers, (time.monotonic()+future.Interval, next(self.__order), future))
+            self._Register(future)
         self.__schedule_signal.set()
+        return future
 
+    # callback: the scheduled function which is cancelled on all its schedules,
+    # or the FutureCallback returned by Scheule
     def CancelSchedule(self, callback:None):
         with self.__callbacks_lock:
-            for k, v in self.__callbacks:
-                if callback in v:
-                    v.remove(callback)
-                if not v:
-                    self.__callbacks.pop(k)
+            self._Cancel(callback)
+
+# Callbacks scheduled as timers of an asyncio event loop. The loop runs on its own
+# thread, and the routers, the network and the timers share it as the only thread.
+class AsyncTickScheduler(CallbackRegistry):
+    def __init__(self):
+        CallbackRegistry.__init__(self)
+        self.Loop = asyncio.new_event_loop()
+        self.__loop_thread = threading.Thread(target=self.Loop.run_forever)
+        self.__loop_thread.daemon = True
+
+    def Now(self):
+        return self.Loop.time()
+
+    def Start(self):
+        self.__loop_thread.start()
+
+    def Stop(self):
+        self.Loop.call_soon_threadsafe(self.Loop.stop)
+
+    # run the function on the loop thread
+    def Call(self, function, *args):
+        if threading.get_ident() == self.__loop_thread.ident:
+            self.Loop.call_soon(function, *args)
+        else:
+            self.Loop.call_soon_threadsafe(function, *args)
+
+    def Scheule(self, callback:None, state:None, interval:float):
+        return self.__Add(FutureCallback(callback, interval, state))
+
+    def ScheduleOnce(self, callback:None, state:None, delay:float):
+        return self.__Add(FutureCallback(callback, delay, state, repeat=False))
+
+    def __Add(self, future:FutureCallback):
+        self.Call(self.__Arm, future, self.Loop.time() + future.Interval)
+        return future
+
+    def __Arm(self, future:FutureCallback, timestamp):
+        if future.Cancelled:
+            return
+        self._Register(future)
+        future.Handle = self.Loop.call_at(timestamp, self.__Fire, future, timestamp)
+
+    def __Fire(self, future:FutureCallback, timestamp):
+        if future.Repeat:
+            nexttick = timestamp + future.Interval
+            if nexttick <= self.Loop.time():
+                nexttick = self.Loop.time() + future.Interval
+            future.Handle = self.Loop.call_at(nexttick, self.__Fire, future, nexttick)
+        else:
+            self._Forget(future)
+        future.Callback(future.State)
+
+    def CancelSchedule(self, callback:None):
+        self.Call(self.__Cancel, callback)
+
+    def __Cancel(self, callback:None):
+        for future in self._Cancel(callback):
+            if future.Handle is not None:
+                future.Handle.cancel()
+
+# Callbacks run in the order of a virtual clock, which jumps straight to the next
+# due callback. Nothing runs on its own, the clock is driven by RunFor/RunUntil
+# on the calling thread, so hours of protocol time take only the cpu time of
+# the callbacks.
+class DiscreteEventScheduler(CallbackRegistry):
+    def __init__(self, start:float=0):
+        CallbackRegistry.__init__(self)
+        self.__now = start
+        self.__timers = [] # heap of tuple(timestamp, order, FutureCallback)
+        self.__order = itertools.count()
+        self.__ready = deque() # tuple(function, args) to run at the current time
+
+    def Now(self):
+        return self.__now
+
+    def Start(self):
+        pass
+
+    def Stop(self):
+        pass
+
+    # run the function at the current time, after the functions already posted
+    def Call(self, function, *args):
+        self.__ready.append((function, args))
+
+    def Scheule(self, callback:None, state:None, interval:float):
+        return self.__Add(FutureCallback(callback, interval, state))
+
+    def ScheduleOnce(self, callback:None, state:None, delay:float):
+        return self.__Add(FutureCallback(callback, delay, state, repeat=False))
+
+    def __Add(self, future:FutureCallback):
+        heapq.heappush(self.__timers, (self.__now + future.Interval, next(self.__order), future))
+        self._Register(future)
+        return future
+
+    def CancelSchedule(self, callback:None):
+        self._Cancel(callback)
+
+    # run all the callbacks due until the timestamp of the virtual clock
+    def RunUntil(self, timestamp:float):
+        while True:
+            if self.__ready:
+                function, args = self.__ready.popleft()
+                function(*args)
+                continue
+            if not self.__timers or self.__timers[0][0] > timestamp:
+                break
+            due, _, future = heapq.heappop(self.__timers)
+            if future.Cancelled:
+                continue
+            self.__now = max(self.__now, due)
+            if future.Repeat:
+                heapq.heappush(self.__timers, (due + future.Interval, next(self.__order), future))
+            else:
+                self._Forget(future)
+            future.Callback(future.State)
+        self.__now = max(self.__now, timestamp)
+
+    def RunFor(self, seconds:float):
+        self.RunUntil(self.__now + seconds)
+
+# the exponential backoff of a throttled action, see SpfInitialDelay
+class Throttle:
+    def __init__(self, initial_delay:float, hold_interval:float, max_hold_interval:float):
+        self.__initial_delay = initial_delay
+        self.__hold_interval = hold_interval
+        self.__max_hold_interval = max_hold_interval
+        self.__hold = hold_interval # the hold interval after the last action
+        self.__last = None # the time of the last action
+
+    # return the seconds to wait from now before the next action
+    def Delay(self, now:float):
+        if self.__last is None or now - self.__last >= self.__max_hold_interval:
+            return self.__initial_delay
+        return max(self.__initial_delay, self.__last + self.__hold - now)
+
+    # record the action taken at now
+    def Fired(self, now:float):
+        if self.__last is None or now - self.__last >= self.__max_hold_interval:
+            self.__hold = self.__hold_interval
+        else:
+            self.__hold = min(self.__hold * 2, self.__max_hold_interval)
+        self.__last = now
+
+# the token bucket of the actions limited to the rate per second with the burst.
+# a token short by less than Tolerance is taken as whole, so the wait for it is
+# never too small to advance the clock
+class RateLimiter:
+    Tolerance = 1e-6
+
+    def __init__(self, rate:float, burst:int):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__last = None
+
+    # the tokens refilled per second from now on
+    def SetRate(self, rate:float):
+        self.__rate = rate
+
+    def __refill(self, now:float):
+        if self.__last is not None:
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__last) * self.__rate)
+        self.__last = now
+
+    # return True if an action can be taken at now, the token is consumed
+    def Take(self, now:float):
+        self.__refill(now)
+        if self.__tokens < 1 - RateLimiter.Tolerance:
+            return False
+        self.__tokens = max(0.0, self.__tokens - 1)
+        return True
+
+    # return the seconds to wait from now for the next token
+    def Wait(self, now:float):
+        self.__refill(now)
+        if self.__tokens >= 1 - RateLimiter.Tolerance:
+            return 0.0
+        return (1 - self.__tokens) / self.__rate
 
 Instance = TickScheduler()
 
+# the current time of the scheduler instance
+def Now():
+    return Instance.Now()
+
 if __name__ == "__main__":
     scheduler = TickScheduler()
     scheduler.Start()
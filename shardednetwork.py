@@ -0,0 +1,227 @@
+import math
+import sys
+import threading
+import multiprocessing
+from collections import deque
+from networkinterface import NetworkInterface
+from messages import Unicast, Broadcast
+from router import Router
+import scheduler
+import spf
+import topology
+
+# split the nodes into shards of balanced size, every shard is grown by breadth
+# first search from an unassigned node, so the adjacent nodes tend to stay in
+# the same shard and the links between the shards are few.
+# return dict with key as the ip and value as the index of the shard
+def PartitionNodes(nodeips, edges:frozenset, shards:int):
+    adjacents = {ip: [] for ip in nodeips}
+    for edge in edges:
+        if len(edge) != 2:
+            continue
+        ip1, ip2 = edge
+        if ip1 in adjacents and ip2 in adjacents:
+            adjacents[ip1].append(ip2)
+            adjacents[ip2].append(ip1)
+    capacity = max(1, math.ceil(len(adjacents) / shards))
+    assignment = {}
+    shard = 0
+    size = 0
+    for seed in sorted(adjacents, key=lambda ip: len(adjacents[ip])):
+        if seed in assignment:
+            continue
+        frontier = deque([seed])
+        while frontier:
+            ip = frontier.popleft()
+            if ip in assignment:
+                continue
+            if size >= capacity and shard < shards - 1:
+                shard += 1
+                size = 0
+            assignment[ip] = shard
+            size += 1
+            frontier.extend(adjacent for adjacent in adjacents[ip] if adjacent not in assignment)
+    return assignment
+
+# a router hosted by another shard, registered so the messages from it are accepted
+class RemoteRouter:
+    def __init__(self, ip):
+        self.ip = ip
+
+# the network interface inside a shard process, the messages to the routers
+# of the other shards are put on the queues of those shards
+class ShardNetworkInterface(NetworkInterface):
+    # assignment: dict with key as the ip and value as the index of the shard
+    # inboxes: list of the message queues of the shards
+    def __init__(self, edges:frozenset, shard:int, assignment:dict, inboxes:list):
+        NetworkInterface.__init__(self, edges)
+        self.__shard = shard
+        self.__assignment = assignment
+        self.__inboxes = inboxes
+
+    def sendto(self, msg:Unicast):
+        shard = self.__assignment.get(msg.dest, self.__shard)
+        if shard == self.__shard:
+            NetworkInterface.sendto(self, msg)
+        elif self.IsLinkUp(msg.src, msg.dest):
+            self.__inboxes[shard].put(msg)
+
+    def broadcast(self, message:Broadcast):
+        dests = {}
+        for ip in message.dests:
+            dests.setdefault(self.__assignment.get(ip, self.__shard), set()).add(ip)
+        for shard, shard_dests in dests.items():
+            shard_message = message.Forwarded(message.src, shard_dests)
+            if shard == self.__shard:
+                NetworkInterface.broadcast(self, shard_message)
+            else:
+                self.__inboxes[shard].put(shard_message)
+
+    # the message received from another shard
+    def receive(self, message):
+        if isinstance(message, Unicast):
+            NetworkInterface.sendto(self, message)
+        else:
+            NetworkInterface.broadcast(self, message)
+
+# the entry of the shard process
+# adjacents: dict with key as the ip of the router hosted by the shard and
+# value as set of namedtuple{TargetIp, Cost}
+def RunShard(shard:int, adjacents:dict, edges:frozenset, assignment:dict
+    , inboxes:list, commands, spf_engine):
+    scheduler.Instance = scheduler.TickScheduler()
+    net = ShardNetworkInterface(edges, shard, assignment, inboxes)
+    routers = {}
+    for ip, states in adjacents.items():
+        routers[ip] = Router(ip, net, states, spf.Engines[spf_engine])
+        net.register(routers[ip])
+        for state in states:
+            if assignment.get(state.TargetIp, shard) != shard:
+                net.register(RemoteRouter(state.TargetIp))
+    net.open()
+    scheduler.Instance.Start()
+
+    def receive():
+        while True:
+            message = inboxes[shard].get()
+            if message is None:
+                break
+            net.receive(message)
+    receiver = threading.Thread(target=receive)
+    receiver.daemon = True
+    receiver.start()
+
+    try:
+        while True:
+            command = commands.recv()
+            if command[0] == 'stop':
+                break
+            elif command[0] == 'fail':
+                routers[command[1]].fail()
+            elif command[0] == 'recover':
+                routers[command[1]].recover()
+            elif command[0] == 'print':
+                routers[command[1]].print_forwardtable()
+                sys.stdout.flush()
+            elif command[0] == 'faillink':
+                net.faillink(command[1], command[2])
+            elif command[0] == 'recoverlink':
+                net.recoverlink(command[1], command[2])
+            commands.send(True)
+    finally:
+        scheduler.Instance.Stop()
+        inboxes[shard].put(None)
+        receiver.join()
+        net.close()
+        commands.send(True)
+
+# the network interface hosting the routers on a pool of processes. the routers
+# are partitioned across the shards, and the messages between the shards are
+# carried by the multiprocessing queues.
+class ShardedNetworkInterface:
+    # edges: frozenset of edges which is a frozenset of the two adjacent nodes
+    # shards: number of the processes
+    def __init__(self, edges:frozenset, shards:int, spf_engine=spf.DefaultEngine):
+        self.__edges = edges
+        self.__shards = shards
+        self.__spf_engine = spf_engine
+        self.__nodes = {} # dict with key as the ip and value as the RouterProxy object
+        self.__assignment = {}
+        self.__processes = []
+        self.__commands = [] # the pipes to send commands to the shards
+        self.__command_locks = []
+        self.__is_opened = False
+
+    def register(self, router):
+        self.__nodes[router.ip] = router
+
+    def open(self):
+        context = multiprocessing.get_context()
+        self.__assignment = PartitionNodes(self.__nodes.keys(), self.__edges, self.__shards)
+        inboxes = [context.Queue() for _ in range(self.__shards)]
+        for shard in range(self.__shards):
+            adjacents = {ip: topology.static_adjacents(ip)
+                for ip, owner in self.__assignment.items() if owner == shard}
+            edges = frozenset(edge for edge in self.__edges
+                if any(self.__assignment.get(ip) == shard for ip in edge))
+            parent, child = context.Pipe()
+            process = context.Process(target=RunShard
+                , args=(shard, adjacents, edges, self.__assignment, inboxes, child, self.__spf_engine))
+            process.daemon = True
+            process.start()
+            self.__processes.append(process)
+            self.__commands.append(parent)
+            self.__command_locks.append(threading.Lock())
+        self.__is_opened = True
+
+    def IsOpen(self):
+        return self.__is_opened
+
+    def close(self):
+        self.__is_opened = False
+        for shard in range(len(self.__processes)):
+            self.__command(shard, ('stop',))
+        for process in self.__processes:
+            process.join()
+
+    # send the command to the shard and wait for its completion
+    def __command(self, shard, command):
+        with self.__command_locks[shard]:
+            self.__commands[shard].send(command)
+            self.__commands[shard].recv()
+
+    def command(self, ip, *command):
+        self.__command(self.__assignment[ip], command + (ip,))
+
+    def faillink(self, ip1, ip2):
+        for shard in range(len(self.__processes)):
+            self.__command(shard, ('faillink', ip1, ip2))
+
+    def recoverlink(self, ip1, ip2):
+        for shard in range(len(self.__processes)):
+            self.__command(shard, ('recoverlink', ip1, ip2))
+
+# the router hosted by a shard process
+class RouterProxy:
+    def __init__(self, ip, net:ShardedNetworkInterface):
+        self.ip = ip
+        self.__net = net
+
+    def fail(self):
+        self.__net.command(self.ip, 'fail')
+
+    def recover(self):
+        self.__net.command(self.ip, 'recover')
+
+    def print_forwardtable(self):
+        self.__net.command(self.ip, 'print')
+
+class ShardedRouterFactory:
+    def __init__(self, nodeips, net:ShardedNetworkInterface):
+        self.__routers = {ip: RouterProxy(ip, net) for ip in nodeips}
+
+    def GetRouters(self):
+        return self.__routers.values()
+
+    def GetRouter(self, ip):
+        return self.__routers.get(ip, None)
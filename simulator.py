@@ -1,25 +1,39 @@
-from networkinterface import NetworkInterface
+from networkinterface import NetworkInterface, EventNetworkInterface
 from router import Router, RouterFactory, RouterFactoryBuilder
+from shardednetwork import ShardedNetworkInterface, ShardedRouterFactory
+from udpnetwork import UdpNetworkInterface
 import topology
 from signal import signal, SIGINT
 from sys import exit
 import atexit
 import scheduler
 import re
-from threading import Timer
+import sys
+import time
+import argparse
+import spf
+import dataplane
+import oracle
+import metrics
+import snapshot
+import replay
+from tabulate import tabulate
 
 routerFactory = None
 network = None
 
-def CreateRouterFactory(net:NetworkInterface):
+def CreateRouterFactory(net:NetworkInterface, spf_engine=spf.DefaultEngine):
+    if isinstance(net, ShardedNetworkInterface):
+        return ShardedRouterFactory(topology.node_ips(), net)
     builder = RouterFactoryBuilder(net)
-    for node in topology.__topology_map.nodes:
-        builder.AddNode(node.ip)
+    builder.SetSpfEngine(spf_engine)
+    for ip in topology.node_ips():
+        builder.AddNode(ip)
     return builder.Build()
 
-def Initialize(net:NetworkInterface):
+def Initialize(net:NetworkInterface, spf_engine=spf.DefaultEngine):
     global routerFactory
-    routerFactory = CreateRouterFactory(net)
+    routerFactory = CreateRouterFactory(net, spf_engine)
     for router in routerFactory.GetRouters():
         net.register(router)
     net.open()
@@ -35,19 +49,138 @@ def printhelp():
     print('* Type "recover [ip]" to recover the router with specified ip')
     print('* Type "fail [ip]-[ip]" to shutdown the link between the two routers')
     print('* Type "recover [ip 1]-[ip 2]" to recover the link between the two routers')
+    print('* Type "traffic [file]" to forward the flows of a traffic matrix through the routers')
+    print('* Type "verify" to compare the forwarding tables with the shortest paths of the topology')
+    print('* Type "stats" or "stats [ip]" to print the metrics of all the routers or the router with specified ip')
+    print('* Type "stats on" or "stats off" to start or stop recording the metrics')
+    print('* Type "save [file]" to save the state of the routers to a snapshot, see --restore')
     print('* type "help" for the instructions')
     print('* type "CTRL-C" to exit')
 
-def InterpretCommand(command:str):
-    ip_pattern = '(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])'
-    print_pattern =  r"^\s*print\s+(" + ip_pattern + ")\s*$"
-    recover_router_pattern = r"^\s*recover\s+(" + ip_pattern + ")\s*$"
-    fail_router_pattern = r"^\s*fail\s+(" + ip_pattern + ")\s*$"
-    recover_link_pattern = r"^\s*recover\s+(?P<ip1>" + ip_pattern + ")-(?P<ip2>" + ip_pattern + ")\s*$"
-    fail_link_pattern = r"^\s*fail\s+(?P<ip1>" + ip_pattern + ")-(?P<ip2>" + ip_pattern  + ")\s*$"
-    help_patter = r"^\s*help\s*$"
+# the time long enough for a failure to be detected by the neighbors and flooded
+def RefreshInterval():
+    return scheduler.PingInterval * 2 + scheduler.BroadcastInterval
+
+def WaitForRefresh():
+    if isinstance(scheduler.Instance, scheduler.DiscreteEventScheduler):
+        scheduler.Instance.RunFor(RefreshInterval())
+        print('\trequest done. route path refreshed at ' + format(scheduler.Now(), '.1f') + 's of virtual time')
+        return
+    print('\trequest done. wait for 10s for route path refresh...')
+    scheduler.Instance.ScheduleOnce(lambda state: print('\troute path refreshed'), None, 10)
+
+PollInterval = 0.1 # seconds between the checks of the convergence
+
+# wait until the forwarding tables of all the active routers match the shortest
+# paths of the current topology, see oracle. the tables are compared only once
+# the routers are settled: nothing is pending and no link state is changed since
+# the previous poll, see Router.convergence_state. the sharded routers are waited
+# for the refresh interval since their tables are not reachable.
+# timeout: seconds waited at most
+# return the seconds waited, None if not converged within the timeout
+def WaitForConvergence(timeout:float):
+    started = scheduler.Now()
+    virtual = isinstance(scheduler.Instance, scheduler.DiscreteEventScheduler)
+    routers = list(routerFactory.GetRouters())
+    if any(not hasattr(router, 'forwarding_table') for router in routers):
+        if virtual:
+            scheduler.Instance.RunFor(RefreshInterval())
+        else:
+            time.sleep(RefreshInterval())
+        return scheduler.Now() - started
+    truth = None # built on the first settled poll, the topology stays the same while waiting
+    last = None # the states of the routers of the previous poll
+    verified = None # the states of the routers last compared with the oracle
+    while True:
+        states = [router.convergence_state() for router in routers if router.IsActive()]
+        if None not in states and states == last and states != verified:
+            verified = states
+            if truth is None:
+                truth = oracle.Build(routers, network)
+            if all(not truth.Verify(router.ip, router.forwarding_table()) for router in routers if router.IsActive()):
+                return scheduler.Now() - started
+        last = states
+        if scheduler.Now() - started >= timeout:
+            return None
+        if virtual:
+            scheduler.Instance.RunFor(PollInterval)
+        else:
+            time.sleep(PollInterval)
+
+# run the commands of a batch one after another, every change of a router or a
+# link is waited until the routers converge. a command is either "[command]" run
+# right after the previous one, or "@[seconds] [command]" run at the seconds after
+# the start of the batch. the blank lines and the lines starting with '#' are skipped.
+# lines: iterable of the commands, a file or sys.stdin
+# timeout: seconds a change is waited at most to converge
+# return the number of the changes which are not converged within the timeout
+def RunBatch(lines, timeout:float):
+    virtual = isinstance(scheduler.Instance, scheduler.DiscreteEventScheduler)
+    failures = 0
+    def wait():
+        nonlocal failures
+        seconds = WaitForConvergence(timeout)
+        if seconds is None:
+            failures += 1
+            print('\trequest done. not converged within ' + format(timeout, '.1f') + 's')
+        else:
+            print('\trequest done. converged in ' + format(seconds, '.1f') + 's')
+    started = scheduler.Now()
+    if WaitForConvergence(timeout) is None:
+        print('\tnot converged within ' + format(timeout, '.1f') + 's at the start')
+    commands = 0
+    for line in lines:
+        command = line.strip()
+        if not command or command.startswith('#'):
+            continue
+        m = __timed_pattern.match(command)
+        if m:
+            due = started + float(m.group(1))
+            command = m.group(3)
+            if virtual:
+                scheduler.Instance.RunUntil(due)
+            elif due > scheduler.Now():
+                time.sleep(due - scheduler.Now())
+        print(format(scheduler.Now() - started, '.1f') + 's> ' + command)
+        InterpretCommand(command, wait)
+        commands += 1
+    print('batch done. ' + str(commands) + ' commands in ' + format(scheduler.Now() - started, '.1f')
+        + 's, ' + str(failures) + ' changes not converged')
+    return failures
+
+# label: the ip of the router, None for the metrics of all the routers
+def PrintStats(label=None):
+    rows = []
+    for name, value in metrics.Instance.Snapshot(label).items():
+        if isinstance(value, dict):
+            value = ', '.join(key + '=' + (format(v, '.6g') if isinstance(v, float) else str(v))
+                for key, v in value.items())
+        rows.append([name, value])
+    print(tabulate(rows, headers=['metric', 'value'], disable_numparse=True))
+
+# the patterns of the commands, compiled once
+__ip_pattern = r'(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])'
+__print_pattern = re.compile(r"^\s*print\s+(" + __ip_pattern + r")\s*$", re.IGNORECASE)
+__recover_router_pattern = re.compile(r"^\s*recover\s+(" + __ip_pattern + r")\s*$", re.IGNORECASE)
+__fail_router_pattern = re.compile(r"^\s*fail\s+(" + __ip_pattern + r")\s*$", re.IGNORECASE)
+__recover_link_pattern = re.compile(r"^\s*recover\s+(?P<ip1>" + __ip_pattern + ")-(?P<ip2>" + __ip_pattern + r")\s*$", re.IGNORECASE)
+__fail_link_pattern = re.compile(r"^\s*fail\s+(?P<ip1>" + __ip_pattern + ")-(?P<ip2>" + __ip_pattern  + r")\s*$", re.IGNORECASE)
+__traffic_pattern = re.compile(r"^\s*traffic\s+(\S+)\s*$", re.IGNORECASE)
+__verify_pattern = re.compile(r"^\s*verify\s*$", re.IGNORECASE)
+__stats_pattern = re.compile(r"^\s*stats(\s+(" + __ip_pattern + r"))?\s*$", re.IGNORECASE)
+__stats_toggle_pattern = re.compile(r"^\s*stats\s+(on|off)\s*$", re.IGNORECASE)
+__save_pattern = re.compile(r"^\s*save\s+(\S+)\s*$", re.IGNORECASE)
+__help_pattern = re.compile(r"^\s*help\s*$", re.IGNORECASE)
+# a command of a batch, "@[seconds] [command]" runs the command at the seconds after the start of the batch
+__timed_pattern = re.compile(r"^\s*@([0-9]+(\.[0-9]*)?)\s+(.*)$")
+
+# wait: called after the command changes a router or a link, the interactive commands
+# print the refresh notice, see WaitForRefresh
+def InterpretCommand(command:str, wait=None):
+    if wait is None:
+        wait = WaitForRefresh
     while True:
-        m = re.match(print_pattern, command, re.IGNORECASE)
+        m = __print_pattern.match(command)
         if m:
             r = routerFactory.GetRouter(m.group(1))
             if r:
@@ -56,31 +189,83 @@ def InterpretCommand(command:str):
             else:
                 print("router '" + m.group(0) + "' does not exist")
             break
-        m = re.match(recover_router_pattern, command, re.IGNORECASE)
+        m = __recover_router_pattern.match(command)
         if m:
-            routerFactory.GetRouter(m.group(1)).recover()
-            print('\trequest done. wait for 10s for route path refresh...')
-            Timer(10, lambda : print('\troute path refreshed')).start()
+            r = routerFactory.GetRouter(m.group(1))
+            if r is None:
+                print("router '" + m.group(1) + "' does not exist")
+                break
+            r.recover()
+            wait()
             break
-        m = re.match(fail_router_pattern, command, re.IGNORECASE)
+        m = __fail_router_pattern.match(command)
         if m:
-            routerFactory.GetRouter(m.group(1)).fail()
-            print('\trequest done. wait for 10s for route path refresh...')
-            Timer(10, lambda : print('\troute path refreshed')).start()
+            r = routerFactory.GetRouter(m.group(1))
+            if r is None:
+                print("router '" + m.group(1) + "' does not exist")
+                break
+            r.fail()
+            wait()
             break
-        m = re.match(recover_link_pattern, command, re.IGNORECASE)
+        m = __recover_link_pattern.match(command)
         if m:
             network.recoverlink(m.group('ip1'), m.group('ip2'))
-            print('\trequest done. wait for 10s for route path refresh...')
-            Timer(10, lambda : print('\troute path refreshed')).start()
+            wait()
             break
-        m = re.match(fail_link_pattern, command, re.IGNORECASE)
+        m = __fail_link_pattern.match(command)
         if m:
             network.faillink(m.group('ip1'), m.group('ip2'))
-            print('\trequest done. wait for 10s for route path refresh...')
-            Timer(10, lambda : print('\troute path refreshed')).start()
+            wait()
             break
-        m = re.match(help_patter, command, re.IGNORECASE)
+        m = __traffic_pattern.match(command)
+        if m:
+            routers = {router.ip: router for router in routerFactory.GetRouters()}
+            if any(not hasattr(router, 'lookup_many') for router in routers.values()):
+                print('traffic is not supported by the sharded routers')
+                break
+            try:
+                dataplane.Forward(routers, dataplane.ReadFlows(m.group(1)), network).print_report()
+                print('\trequest done.')
+            except (OSError, ValueError) as e:
+                print(e)
+            break
+        m = __verify_pattern.match(command)
+        if m:
+            routers = list(routerFactory.GetRouters())
+            if any(not hasattr(router, 'forwarding_table') for router in routers):
+                print('verify is not supported by the sharded routers')
+                break
+            mismatches = oracle.VerifyRouters(routers, network)
+            for mismatch in mismatches[:10]:
+                print('\t' + mismatch.RouterIp + ' -> ' + mismatch.DestIp + ': expected '
+                    + str(mismatch.Expected) + ', actual ' + str(mismatch.Actual))
+            print('\trequest done. ' + str(len(mismatches)) + ' mismatching routes')
+            break
+        m = __stats_toggle_pattern.match(command)
+        if m:
+            metrics.Instance.Enabled = m.group(1).lower() == 'on'
+            print('\trequest done. metrics are ' + ('on' if metrics.Instance.Enabled else 'off'))
+            break
+        m = __stats_pattern.match(command)
+        if m:
+            if not metrics.Instance.Enabled:
+                print('\tmetrics are off, type "stats on" to start recording')
+            PrintStats(m.group(2))
+            print('\trequest done.')
+            break
+        m = __save_pattern.match(command)
+        if m:
+            routers = list(routerFactory.GetRouters())
+            if any(not hasattr(router, 'snapshot') for router in routers):
+                print('save is not supported by the sharded routers')
+                break
+            try:
+                size = snapshot.Save(routers, m.group(1))
+                print('\trequest done. ' + str(len(routers)) + ' routers saved in ' + str(size) + ' bytes')
+            except OSError as e:
+                print(e)
+            break
+        m = __help_pattern.match(command)
         if m:
             printhelp()
             break
@@ -90,26 +275,132 @@ def InterpretCommand(command:str):
 def exithandler(signal_received, frame):
     exit(0)
 
-def Run():
+# tick_workers: number of threads running the router ticks, 0 to run them on the scheduler thread
+# shards: number of processes hosting the routers, 0 to host them in this process
+# use_asyncio: run the routers, the network and the timers on a single asyncio event loop
+# virtual_clock: run the routers on a virtual clock which is advanced by the commands
+# topology_file: the topology config, .json or one of the line based formats of topology.read_records
+# use_udp: carry the messages as udp datagrams on the loopback, see udpnetwork
+# batched: drain the message queue in bulk and hand every router its messages in one call
+# snapshot_file: the snapshot restored as the converged state of the routers, see the "save" command
+# record_file: the log written with every message delivered to the routers, see replay
+# batch_file: run the commands of the file and exit, '-' for the standard input, see RunBatch
+# convergence_timeout: seconds a change of the batch is waited at most to converge
+# metrics_dump: the file appended with the json snapshot of the metrics on every metrics_interval
+def Run(spf_engine=spf.DefaultEngine, tick_workers=0, shards=0, use_asyncio=False, virtual_clock=False
+    , topology_file='topology.json', use_metrics=False, metrics_dump=None, metrics_interval=10.0
+    , use_udp=False, batched=False, snapshot_file=None, record_file=None, batch_file=None
+    , convergence_timeout=None):
     signal(SIGINT, exithandler)
-    topology.create_map()
+    metrics.Instance.Enabled = use_metrics or metrics_dump is not None
+    if virtual_clock:
+        scheduler.Instance = scheduler.DiscreteEventScheduler()
+    elif use_asyncio:
+        scheduler.Instance = scheduler.AsyncTickScheduler()
+    elif tick_workers > 0:
+        scheduler.Instance = scheduler.TickScheduler(tick_workers)
     global network
-    network = NetworkInterface(topology.static_edges())
+    try:
+        topology.create_map(topology_file)
+        if shards > 0:
+            network = ShardedNetworkInterface(topology.static_edges(), shards, spf_engine)
+        elif use_udp:
+            network = UdpNetworkInterface(topology.static_edges())
+        elif use_asyncio or virtual_clock:
+            network = EventNetworkInterface(topology.static_edges(), scheduler.Instance)
+        else:
+            network = NetworkInterface(topology.static_edges(), batched)
+    except (OSError, ValueError) as e:
+        print(e)
+        return 1
     atexit.register(TearDown, network)
+    recorder = None
+    if record_file is not None:
+        recorder = replay.Recorder(record_file)
+        network.set_recorder(recorder)
     try:
-        Initialize(network)
+        Initialize(network, spf_engine)
         scheduler.Instance.Start()
+        if metrics_dump is not None:
+            metrics.Instance.StartDump(metrics_dump, metrics_interval)
+        restored = set()
+        if snapshot_file is not None:
+            try:
+                restored = snapshot.Restore(routerFactory.GetRouters(), snapshot_file)
+            except (OSError, ValueError) as e:
+                print(e)
+                return 1
+            print(str(len(restored)) + ' routers restored from ' + snapshot_file)
         for router in routerFactory.GetRouters():
-            router.recover()
+            if router.ip not in restored:
+                router.recover()
+        if batch_file is not None:
+            if convergence_timeout is None:
+                convergence_timeout = RefreshInterval() * 2
+            if batch_file == '-':
+                return RunBatch(sys.stdin, convergence_timeout)
+            with open(batch_file, 'r') as f:
+                return RunBatch(f, convergence_timeout)
+        if virtual_clock and not restored:
+            scheduler.Instance.RunFor(RefreshInterval())
         printhelp()
         while True:
-            command = input()
+            try:
+                command = input()
+            except EOFError:
+                break
             if command:
                 InterpretCommand(command)
     finally:
         scheduler.Instance.Stop()
         if network.IsOpen():
             network.close()    
+        if recorder is not None:
+            recorder.Close()
 
 if __name__ == "__main__":
-    Run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Dynamic routing simulator')
+    parser.add_argument('--spf', choices=sorted(spf.Engines.keys()), default=spf.DefaultEngine
+        , help='the shortest path first engine of the routers')
+    parser.add_argument('--tick-workers', type=int, default=0
+        , help='number of threads running the router ticks, 0 to run them on the scheduler thread')
+    parser.add_argument('--shards', type=int, default=0
+        , help='number of processes hosting the routers, 0 to host them in this process')
+    parser.add_argument('--asyncio', action='store_true'
+        , help='run the routers, the network and the timers on a single asyncio event loop')
+    parser.add_argument('--virtual-clock', action='store_true'
+        , help='run the routers on a virtual clock, the route paths are refreshed instantly')
+    parser.add_argument('--topology', default='topology.json'
+        , help='the topology file, .json, .jsonl, .csv or .edges')
+    parser.add_argument('--metrics', action='store_true'
+        , help='record the metrics from the start, see the "stats" command')
+    parser.add_argument('--metrics-dump'
+        , help='append the json snapshot of the metrics to the file periodically, implies --metrics')
+    parser.add_argument('--metrics-interval', type=float, default=10.0
+        , help='seconds between the snapshots of --metrics-dump')
+    parser.add_argument('--udp', action='store_true'
+        , help='carry the messages as udp datagrams on the loopback, with the threaded scheduler')
+    parser.add_argument('--batched', action='store_true'
+        , help='deliver the queued messages in batches, one locked call and at most one spf per router and batch')
+    parser.add_argument('--restore', metavar='SNAPSHOT'
+        , help='start from the routers saved by the "save" command, not supported with --shards')
+    parser.add_argument('--record', metavar='LOG'
+        , help='write every message delivered to the routers to the log, see replay.py. not supported with --shards')
+    parser.add_argument('--batch', metavar='FILE'
+        , help='run the commands of the file, "-" for the standard input, and exit. a change is waited until converged')
+    parser.add_argument('--convergence-timeout', type=float
+        , help='seconds a change of --batch is waited at most to converge, twice the refresh interval by default')
+    args = parser.parse_args()
+    if args.record is not None and args.shards > 0:
+        parser.error('--record is not supported with --shards')
+    if args.restore is not None and args.shards > 0:
+        parser.error('--restore is not supported with --shards')
+    # the udp receiver and the shard processes run in real time, on the threads of their own
+    if args.udp and (args.virtual_clock or args.asyncio or args.shards > 0):
+        parser.error('--udp is not supported with --virtual-clock, --asyncio or --shards')
+    if args.shards > 0 and args.virtual_clock:
+        parser.error('--shards is not supported with --virtual-clock')
+    failures = Run(args.spf, args.tick_workers, args.shards, args.asyncio, args.virtual_clock, args.topology
+        , args.metrics, args.metrics_dump, args.metrics_interval, args.udp, args.batched, args.restore, args.record
+        , args.batch, args.convergence_timeout)
+    exit(1 if failures else 0)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import mmap
+import struct
+import scheduler
+import spf
+import wireformat
+from messages import NodeAdjacentsDatabase
+from router import RouterSnapshot
+
+# the checkpoint of the converged routers, restored to start an experiment
+# without waiting for the hellos and the floods. the file is memory mapped on
+# load and decoded in place, in network byte order:
+#
+# header:   magic (4s), version (B), time of the save (d), number of link states (I),
+#           link states, number of routers (I), routers
+# link state: the advertisement of wireformat, the sequence is 0 if no
+#           advertisement of the node is accepted by the router. the link states
+#           held by many routers are written once
+# router:   ip (4s), active (B), sequence (I), number of online adjacents (H),
+#           online adjacents (4s each), number of link states (I), the indexes
+#           of the link states (I each), number of routes (I), routes
+# route:    dest ip (4s), cost (d), number of precedents (H), precedents (4s each)
+
+Magic = b'RSNP'
+Version = 1
+
+__header = struct.Struct('!4sBd')
+__router = struct.Struct('!4sBIH')
+__ip = struct.Struct('!4s')
+__count = struct.Struct('!I')
+__route = struct.Struct('!4sdH')
+
+# link_states: dict with key as tuple(ip, sequence, adjacents) and value as its index
+def __encode_router(state:RouterSnapshot, link_states:dict):
+    parts = [__router.pack(wireformat.PackIp(state.Ip), 1 if state.Active else 0, state.Sequence, len(state.Online))]
+    parts.extend(wireformat.PackIp(ip) for ip in state.Online)
+    parts.append(__count.pack(len(state.LinkStates)))
+    parts.extend(__count.pack(link_states[(ip, sequence, adjacents)])
+        for ip, (sequence, adjacents) in state.LinkStates.items())
+    parts.append(__count.pack(len(state.Table)))
+    for dest, path in state.Table.items():
+        parts.append(__route.pack(wireformat.PackIp(dest), path.Cost, len(path.Precedents)))
+        parts.extend(wireformat.PackIp(ip) for ip in path.Precedents)
+    return b''.join(parts)
+
+# link_states: list of NodeAdjacentsDatabase in the order of the indexes
+def __decode_router(view, offset, link_states:list):
+    ip, active, sequence, count = __router.unpack_from(view, offset)
+    offset += __router.size
+    online = []
+    for _ in range(count):
+        online.append(wireformat.UnpackIp(__ip.unpack_from(view, offset)[0]))
+        offset += __ip.size
+    count = __count.unpack_from(view, offset)[0]
+    offset += __count.size
+    states = {}
+    for _ in range(count):
+        payload = link_states[__count.unpack_from(view, offset)[0]]
+        states[payload.NodeIp] = (payload.Sequence, payload.Adjacents)
+        offset += __count.size
+    count = __count.unpack_from(view, offset)[0]
+    offset += __count.size
+    table = {}
+    for _ in range(count):
+        dest, cost, precedents = __route.unpack_from(view, offset)
+        offset += __route.size
+        ips = set()
+        for _ in range(precedents):
+            ips.add(wireformat.UnpackIp(__ip.unpack_from(view, offset)[0]))
+            offset += __ip.size
+        table[wireformat.UnpackIp(dest)] = spf.PathLink(Precedents=ips, Cost=wireformat.DecodeCost(cost))
+    return RouterSnapshot(Ip=wireformat.UnpackIp(ip), Active=bool(active), Sequence=sequence
+        , Online=frozenset(online), LinkStates=states, Table=table), offset
+
+# write the snapshots of the routers to the file
+# return the number of the bytes written
+def Save(routers, file):
+    states = [router.snapshot() for router in routers]
+    link_states = {}
+    for state in states:
+        for ip, (sequence, adjacents) in state.LinkStates.items():
+            link_states.setdefault((ip, sequence, adjacents), len(link_states))
+    size = 0
+    with open(file, 'wb') as f:
+        size += f.write(__header.pack(Magic, Version, scheduler.Now()))
+        size += f.write(__count.pack(len(link_states)))
+        for ip, sequence, adjacents in link_states:
+            size += f.write(wireformat.EncodeAdvertisement(NodeAdjacentsDatabase(ip, adjacents, sequence)))
+        size += f.write(__count.pack(len(states)))
+        for state in states:
+            size += f.write(__encode_router(state, link_states))
+    return size
+
+# return dict with key as the ip and value as RouterSnapshot.
+# raise ValueError if the file is not a snapshot of this version
+def Load(file):
+    with open(file, 'rb') as f:
+        buffer = None
+        view = None
+        try:
+            # an empty file cannot be mapped, raising ValueError
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(buffer)
+            magic, version, _ = __header.unpack_from(view, 0)
+            if magic != Magic:
+                raise ValueError('not a router snapshot')
+            if version != Version:
+                raise ValueError('unsupported snapshot version ' + str(version))
+            count = __count.unpack_from(view, __header.size)[0]
+            offset = __header.size + __count.size
+            link_states = []
+            for _ in range(count):
+                payload, offset = wireformat.DecodeAdvertisement(view, offset)
+                link_states.append(payload)
+            count = __count.unpack_from(view, offset)[0]
+            offset += __count.size
+            states = {}
+            for _ in range(count):
+                state, offset = __decode_router(view, offset, link_states)
+                states[state.Ip] = state
+            return states
+        except IndexError:
+            raise ValueError(file + ': invalid link state index') from None
+        except struct.error as e:
+            raise ValueError(file + ': truncated snapshot: ' + str(e)) from None
+        except ValueError as e:
+            raise ValueError(file + ': ' + str(e)) from None
+        finally:
+            if view is not None:
+                view.release()
+            if buffer is not None:
+                buffer.close()
+
+# restore the routers from the snapshot file, the routers missing in the
+# snapshot are left as they are.
+# raise ValueError if the snapshot has a router which is not in the routers
+# return the set of the ips of the restored routers
+def Restore(routers, file):
+    states = Load(file)
+    routers = {router.ip: router for router in routers}
+    unknown = [ip for ip in states if ip not in routers]
+    if unknown:
+        raise ValueError(file + ": unknown router '" + unknown[0] + "'")
+    for ip, state in states.items():
+        routers[ip].restore(state)
+    return set(states)
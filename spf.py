@@ -0,0 +1,283 @@
+import argparse
+import heapq
+import math
+import random
+import topology
+from collections import namedtuple
+
+# the entry of the forwarding table
+# Precedents: set of ips of the previous hops on the equal cost shortest paths
+PathLink = namedtuple('PathLink', ['Precedents', 'Cost'])
+
+# Dijsktra’s Algorithm with multi path routing, the next vertex is found by
+# scanning all the unsettled vertexes, O(V²) per run.
+class LinearSpf:
+    # root: the ip of the calculating router
+    # link_states: dict with key as the ip of node and value as set of namedtuple{TargetIp, Cost}
+    # changes: the links changed since the last run, only used by the incremental engine
+    # return the distance map, key:dest ip; value: PathLink
+    def Calculate(self, root, link_states:dict, changes=None):
+        N = set([root])
+        D = {}
+        # Initialize the distance map
+        root_links = {link.TargetIp: link.Cost for link in link_states.get(root, ())}
+        for v in link_states:
+            if v == root:
+                continue
+            if v in root_links:
+                D[v] = PathLink(Precedents=set([root]), Cost=root_links[v])
+            else:
+                D[v] = PathLink(Precedents=set(), Cost=math.inf)
+
+        while len(N) < len(link_states):
+            w = None
+            for v in link_states:
+                if v in N:
+                    continue
+                if w is None:
+                    w = v
+                elif D[w].Cost > D[v].Cost:
+                    w = v
+            N.add(w)
+            for v in link_states[w]:
+                if v.TargetIp in N:
+                    continue
+                if D[v.TargetIp].Cost > D[w].Cost + v.Cost:
+                    D[v.TargetIp] = PathLink(
+                        Precedents=set([w]),
+                        Cost=D[w].Cost + v.Cost)
+                elif D[v.TargetIp].Cost == D[w].Cost + v.Cost:
+                    D[v.TargetIp].Precedents.add(w)
+        return D
+
+# Dijsktra’s Algorithm with multi path routing on a binary heap,
+# O((V + E)·log V) per run. Stale heap entries are skipped lazily instead of
+# decreasing the key in place.
+class HeapSpf:
+    def Calculate(self, root, link_states:dict, changes=None):
+        D = {v: PathLink(Precedents=set(), Cost=math.inf) for v in link_states if v != root}
+        settled = set([root])
+        heap = []
+        for link in link_states.get(root, ()):
+            if link.TargetIp == root:
+                continue
+            if D[link.TargetIp].Cost > link.Cost:
+                D[link.TargetIp] = PathLink(Precedents=set([root]), Cost=link.Cost)
+                heapq.heappush(heap, (link.Cost, link.TargetIp))
+        while heap:
+            cost, w = heapq.heappop(heap)
+            if w in settled or cost > D[w].Cost:
+                continue
+            settled.add(w)
+            for v in link_states[w]:
+                if v.TargetIp in settled:
+                    continue
+                path = D[v.TargetIp]
+                if path.Cost > cost + v.Cost:
+                    D[v.TargetIp] = PathLink(Precedents=set([w]), Cost=cost + v.Cost)
+                    heapq.heappush(heap, (cost + v.Cost, v.TargetIp))
+                elif path.Cost == cost + v.Cost:
+                    path.Precedents.add(w)
+        return D
+
+# Incremental Dijsktra’s Algorithm with multi path routing. The shortest path
+# DAG of the previous run is kept, and only the subtrees affected by the
+# changed links are repaired. A full run is done on the first calculation, and
+# on every calculation while a link costs 0: the equal cost precedents of the
+# zero cost links may form a cycle, which keeps a cut subtree valid through itself.
+class IncrementalSpf:
+    def __init__(self):
+        self.__root = None
+        self.__distances = None # the distance map of the last run
+        self.__children = {} # key: ip; value: set of ips which take the key as a precedent
+        self.__incomings = {} # key: ip; value: dict{source ip: cost} of the links toward the key
+        self.__zero_cost = False # a link of the last full run costs 0
+
+    # changes: set of tuple(NodeIp, TargetIp) of the links changed since the last run,
+    # None to force a full run
+    def Calculate(self, root, link_states:dict, changes=None):
+        if changes is None or self.__distances is None or root != self.__root or self.__zero_cost \
+        or any(link.Cost <= 0 for u, v in changes for link in link_states.get(u, ()) if link.TargetIp == v):
+            return self.__full_calculate(root, link_states)
+        if changes:
+            self.__repair(link_states, changes)
+        return self.__distances
+
+    def __full_calculate(self, root, link_states:dict):
+        self.__root = root
+        self.__distances = HeapSpf().Calculate(root, link_states)
+        self.__children = {v: set() for v in link_states}
+        for v, path in self.__distances.items():
+            for precedent in path.Precedents:
+                self.__children[precedent].add(v)
+        self.__incomings = {v: {} for v in link_states}
+        self.__zero_cost = False
+        for u, links in link_states.items():
+            for link in links:
+                self.__incomings.setdefault(link.TargetIp, {})[u] = link.Cost
+                if link.Cost <= 0:
+                    self.__zero_cost = True
+        return self.__distances
+
+    def __cost(self, v):
+        if v == self.__root:
+            return 0
+        path = self.__distances.get(v, None)
+        return path.Cost if path is not None else math.inf
+
+    def __set_path(self, v, precedents:set, cost):
+        old = self.__distances.get(v, None)
+        if old is not None:
+            for precedent in old.Precedents:
+                self.__children.get(precedent, set()).discard(v)
+        for precedent in precedents:
+            self.__children.setdefault(precedent, set()).add(v)
+        self.__distances[v] = PathLink(Precedents=precedents, Cost=cost)
+
+    def __add_precedent(self, v, precedent):
+        self.__distances[v].Precedents.add(precedent)
+        self.__children.setdefault(precedent, set()).add(v)
+
+    def __remove_precedent(self, v, precedent):
+        self.__distances[v].Precedents.discard(precedent)
+        self.__children.get(precedent, set()).discard(v)
+
+    # reset the vertex and all the vertexes which lose their last precedent with it
+    def __invalidate(self, v, invalid:set):
+        stack = [v]
+        while stack:
+            w = stack.pop()
+            if w in invalid:
+                continue
+            invalid.add(w)
+            self.__set_path(w, set(), math.inf)
+            for child in list(self.__children.get(w, ())):
+                self.__remove_precedent(child, w)
+                if not self.__distances[child].Precedents:
+                    stack.append(child)
+
+    def __repair(self, link_states:dict, changes):
+        root = self.__root
+        heap = []
+        invalid = set()
+        updated = [] # list of tuple(NodeIp, TargetIp, Cost) with the current cost of the changed links
+        # update the incoming links, and cut the DAG on the links which become more expensive
+        for u, v in changes:
+            cost = next((link.Cost for link in link_states.get(u, ()) if link.TargetIp == v), None)
+            incomings = self.__incomings.setdefault(v, {})
+            old = incomings.pop(u, None)
+            if cost is not None:
+                incomings[u] = cost
+            for w in (u, v):
+                if w != root and w not in self.__distances:
+                    self.__set_path(w, set(), math.inf)
+            if v == root:
+                continue
+            updated.append((u, v, cost))
+            if u in self.__distances[v].Precedents and (cost is None or old is None or cost > old):
+                self.__remove_precedent(v, u)
+                if not self.__distances[v].Precedents:
+                    self.__invalidate(v, invalid)
+        # seed the invalidated vertexes from their valid neighbors
+        for v in invalid:
+            for u, cost in self.__incomings.get(v, {}).items():
+                if u in invalid or self.__cost(u) == math.inf:
+                    continue
+                total = self.__cost(u) + cost
+                if total < self.__distances[v].Cost:
+                    self.__set_path(v, set([u]), total)
+                elif total == self.__distances[v].Cost:
+                    self.__add_precedent(v, u)
+            if self.__distances[v].Cost < math.inf:
+                heapq.heappush(heap, (self.__distances[v].Cost, v))
+        # seed the vertexes reached by the links which become cheaper
+        for u, v, cost in updated:
+            if cost is None or u in invalid or self.__cost(u) == math.inf:
+                continue
+            total = self.__cost(u) + cost
+            if total < self.__distances[v].Cost:
+                self.__set_path(v, set([u]), total)
+                heapq.heappush(heap, (total, v))
+            elif total == self.__distances[v].Cost:
+                self.__add_precedent(v, u)
+        # propagate the new distances
+        while heap:
+            cost, w = heapq.heappop(heap)
+            if cost > self.__distances[w].Cost:
+                continue
+            for link in link_states.get(w, ()):
+                v = link.TargetIp
+                if v == root:
+                    continue
+                total = cost + link.Cost
+                path = self.__distances.get(v, None)
+                if path is None or total < path.Cost:
+                    self.__set_path(v, set([w]), total)
+                    heapq.heappush(heap, (total, v))
+                elif total == path.Cost and w not in path.Precedents:
+                    self.__add_precedent(v, w)
+
+# the spf engines selectable by name, the value is the engine class
+Engines = {
+    'linear': LinearSpf,
+    'heap': HeapSpf,
+    'incremental': IncrementalSpf,
+}
+
+DefaultEngine = 'heap'
+
+# the distance map without the unreachable nodes, the precedents as frozenset
+def __comparable(distances:dict):
+    return {ip: (path.Cost, frozenset(path.Precedents)) for ip, path in distances.items() if path.Cost != math.inf}
+
+# compare the engine with HeapSpf on random graphs whose links are changed in
+# steps, the changes of every step are passed to the engine as a router would.
+# costs: the link costs to choose from, None removes the link. the equal cost
+# precedents over the zero cost links differ between LinearSpf and HeapSpf, the
+# topology files have positive costs only, see topology.read_records
+# return list of tuple(seed, step) of the first step which differs per graph
+def CompareEngine(engine, seeds, steps=40, costs=(1, 2, 3, None)):
+    failures = []
+    for seed in seeds:
+        rand = random.Random(seed)
+        count = rand.randint(5, 25)
+        link_states = {str(i): set() for i in range(count)}
+        def set_link(u, v, cost):
+            link_states[u] = set(link for link in link_states[u] if link.TargetIp != v)
+            if cost is not None:
+                link_states[u].add(topology.AdjacentState(TargetIp=v, Cost=cost))
+        for _ in range(count * 2):
+            u, v = map(str, rand.sample(range(count), 2))
+            cost = rand.choice([cost for cost in costs if cost is not None])
+            set_link(u, v, cost)
+            set_link(v, u, cost)
+        tested = engine()
+        tested.Calculate('0', link_states)
+        for step in range(steps):
+            changes = set()
+            for _ in range(rand.randint(1, 3)):
+                u, v = map(str, rand.sample(range(count), 2))
+                cost = rand.choice(costs)
+                set_link(u, v, cost)
+                changes.add((u, v))
+                if rand.random() < 0.7:
+                    set_link(v, u, cost)
+                    changes.add((v, u))
+            actual = __comparable(tested.Calculate('0', link_states, changes))
+            if actual != __comparable(HeapSpf().Calculate('0', link_states)):
+                failures.append((seed, step))
+                break
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare an spf engine with the heap engine on random graphs')
+    parser.add_argument('--spf', choices=sorted(Engines.keys()), default='incremental')
+    parser.add_argument('--seeds', type=int, default=300, help='number of the random graphs')
+    parser.add_argument('--zero-costs', action='store_true', help='draw the zero cost links as well')
+    args = parser.parse_args()
+    failures = CompareEngine(Engines[args.spf], range(args.seeds)
+        , costs=(0, 1, 2, 3, None) if args.zero_costs else (1, 2, 3, None))
+    for seed, step in failures:
+        print('seed ' + str(seed) + ' differs at step ' + str(step))
+    print(str(args.seeds - len(failures)) + ' of ' + str(args.seeds) + ' graphs agree')
+    exit(1 if failures else 0)
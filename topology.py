@@ -1,25 +1,75 @@
 import json
-from types import SimpleNamespace 
 from tabulate import tabulate
+import csv
+import ipaddress
 import itertools
+import math
+import os
+import random
+import sys
 from collections import namedtuple
 
 __topology_map = None
 
+AdjacentState = namedtuple('AdjacentState', ['TargetIp', 'Cost'])
+Node = namedtuple('Node', ['index', 'ip'])
+Link = namedtuple('Link', ['link', 'cost'])
+
+# the topology indexed once when it is loaded, every query is O(1) or O(degree)
+class TopologyMap:
+    def __init__(self):
+        self.nodes = [] # list of namedtuple{index, ip}
+        self.ip_to_index = {}
+        self.index_to_ip = {}
+        self.adjacents = {} # key: node index; value: dict{adjacent node index: cost}
+        self.__edges = None
+
+    def AddNode(self, index, ip):
+        ip = sys.intern(ip) # the ips are the keys of every link state database
+        self.nodes.append(Node(index=index, ip=ip))
+        self.ip_to_index[ip] = index
+        self.index_to_ip[index] = ip
+        self.adjacents.setdefault(index, {})
+
+    def AddLink(self, index1, index2, cost):
+        self.adjacents.setdefault(index1, {})[index2] = cost
+        self.adjacents.setdefault(index2, {})[index1] = cost
+        self.__edges = None
+
+    # iterate the links as namedtuple{link, cost}, link is the tuple of the two node indexes
+    def Links(self):
+        for index1, adjacents in self.adjacents.items():
+            for index2, cost in adjacents.items():
+                if index1 < index2:
+                    yield Link(link=(index1, index2), cost=cost)
+
+    # frozenset of the links between the known nodes, each is a frozenset of the two ips
+    def Edges(self):
+        if self.__edges is None:
+            self.__edges = frozenset(
+                frozenset((self.index_to_ip[index1], self.index_to_ip[index2]))
+                for index1, adjacents in self.adjacents.items() if index1 in self.index_to_ip
+                for index2 in adjacents if index2 in self.index_to_ip and index1 < index2)
+        return self.__edges
+
+MaxPrintNodes = 100 # larger maps are only summarized
+
 def print_map():
+    if len(__topology_map.nodes) > MaxPrintNodes:
+        print('Topology Map: ' + str(len(__topology_map.nodes)) + ' nodes, '
+            + str(len(__topology_map.Edges())) + ' links')
+        return
     map = []
     for i, node1 in enumerate(__topology_map.nodes):
+        adjacents = __topology_map.adjacents[node1.index]
         row = []
         for j, node2 in enumerate(__topology_map.nodes):
             if j < i:
-                state = next((link 
-                for link in __topology_map.links 
-                if(node1.index in link.link and node2.index in link.link))
-                , None)
-                if state is None:
+                cost = adjacents.get(node2.index, None)
+                if cost is None:
                     row.append('∞')
                 else:
-                    row.append(state.cost)
+                    row.append(cost)
             elif j == i:
                 row.append('0')
             else:
@@ -31,70 +81,279 @@ def print_map():
     print(table)
     print('===========================Topology Map===================================')
 
-# initialize the topology from a config file
+# index the map of the config file layout: dict{nodes: [{index, ip}], links: [{link, cost}]}
+def __index_map(topology_map:dict):
+    indexed = TopologyMap()
+    for node in topology_map['nodes']:
+        indexed.AddNode(node['index'], node['ip'])
+    for link in topology_map['links']:
+        indexed.AddLink(link['link'][0], link['link'][1], link['cost'])
+    return indexed
+
+# read the records of a topology file one line at a time, without loading the whole file.
+# the format is chosen by the file extension:
+# .jsonl: one json object per line, {"index": 1, "ip": "10.0.0.1"} or {"link": [1, 2], "cost": 3}
+# .csv: one row per line, "node,1,10.0.0.1" or "link,1,2,3"
+# .edges: "10.0.0.1 10.0.0.2 3" per line, the nodes are indexed in the order they appear
+# the blank lines and the lines starting with '#' are skipped, a link must follow its nodes.
+# the costs are positive, a link joins two different nodes and is given once.
+# yield tuple('node', index, ip) or tuple('link', index1, index2, cost)
+def read_records(file):
+    extension = os.path.splitext(file)[1].lower()
+    if extension not in ('.jsonl', '.csv', '.edges'):
+        raise ValueError(file + ": unsupported topology format '" + extension + "'")
+    indexes = {} # the indexes of the nodes read, key: ip
+    node_indexes = set() # the indexes of the nodes read
+    links = set() # the links read, each is a frozenset of the two node indexes
+    with open(file, 'r', newline='') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if extension in ('.jsonl', '.csv'):
+                    if extension == '.jsonl':
+                        record = __json_record(json.loads(line))
+                    else:
+                        record = __csv_record(next(csv.reader([line])))
+                    if record[0] == 'node':
+                        if record[1] in node_indexes or record[2] in indexes:
+                            raise ValueError('duplicate node ' + str(record[1]) + " '" + record[2] + "'")
+                        node_indexes.add(record[1])
+                        indexes[record[2]] = record[1]
+                    else:
+                        for index in record[1:3]:
+                            if index not in node_indexes:
+                                raise ValueError('link to unknown node ' + str(index))
+                        __check_link(record, links)
+                    yield record
+                else:
+                    fields = line.split()
+                    if len(fields) != 3:
+                        raise ValueError('expected "ip ip cost"')
+                    link_ips = [__valid_ip(ip) for ip in fields[:2]]
+                    cost = __valid_cost(fields[2])
+                    if link_ips[0] == link_ips[1]:
+                        raise ValueError("link from node '" + link_ips[0] + "' to itself")
+                    for ip in link_ips:
+                        if ip not in indexes:
+                            indexes[ip] = len(indexes) + 1
+                            yield ('node', indexes[ip], ip)
+                    record = ('link', indexes[link_ips[0]], indexes[link_ips[1]], cost)
+                    __check_link(record, links)
+                    yield record
+            except ValueError as e:
+                raise ValueError(file + ':' + str(number) + ': ' + str(e)) from None
+
+# raise ValueError if the link record joins a node to itself or is already read
+# links: the links read, the link of the record is added
+def __check_link(record, links:set):
+    if record[1] == record[2]:
+        raise ValueError('link from node ' + str(record[1]) + ' to itself')
+    link = frozenset(record[1:3])
+    if link in links:
+        raise ValueError('duplicate link ' + str(record[1]) + '-' + str(record[2]))
+    links.add(link)
+
+def __json_record(record):
+    if not isinstance(record, dict):
+        raise ValueError('expected a json object')
+    if 'link' in record:
+        link = record['link']
+        if not isinstance(link, list) or len(link) != 2:
+            raise ValueError('link must be a list of two node indexes')
+        return ('link', __valid_index(link[0]), __valid_index(link[1]), __valid_cost(record.get('cost')))
+    if 'index' in record and 'ip' in record:
+        return ('node', __valid_index(record['index']), __valid_ip(record['ip']))
+    raise ValueError('expected a node {"index", "ip"} or a link {"link", "cost"}')
+
+def __csv_record(fields):
+    if len(fields) == 3 and fields[0] == 'node':
+        return ('node', __valid_index(fields[1]), __valid_ip(fields[2]))
+    if len(fields) == 4 and fields[0] == 'link':
+        return ('link', __valid_index(fields[1]), __valid_index(fields[2]), __valid_cost(fields[3]))
+    raise ValueError('expected "node,index,ip" or "link,index,index,cost"')
+
+def __valid_index(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ValueError("invalid node index '" + str(value) + "'")
+    return value
+
+def __valid_ip(value):
+    try:
+        return str(ipaddress.IPv4Address(value))
+    except (ipaddress.AddressValueError, TypeError):
+        raise ValueError("invalid node ip '" + str(value) + "'") from None
+
+def __valid_cost(value):
+    if isinstance(value, str):
+        try:
+            value = float(value) if any(c in value for c in '.eE') else int(value)
+        except ValueError:
+            pass
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 < value < math.inf:
+        raise ValueError("invalid link cost '" + str(value) + "'")
+    return value
+
+# index the records of a topology file as they are read
+def __stream_map(file):
+    indexed = TopologyMap()
+    for record in read_records(file):
+        if record[0] == 'node':
+            indexed.AddNode(*record[1:])
+        else:
+            indexed.AddLink(*record[1:])
+    return indexed
+
+# initialize the topology from a config file, either the json map or one of
+# the line based formats streamed by read_records
 def create_map(file='topology.json'):
     global __topology_map
     if __topology_map == None:
-        with open(file, 'r') as f:
-            __topology_map = json.load(f, object_hook=lambda d: SimpleNamespace(**d))
+        if os.path.splitext(file)[1].lower() == '.json':
+            with open(file, 'r') as f:
+                __topology_map = __index_map(json.load(f))
+        else:
+            __topology_map = __stream_map(file)
     print_map()
 
+# initialize the topology from a map of the same layout as the config file,
+# e.g. the map created by one of the generate_* functions
+def load_map(topology_map:dict, verbose=False):
+    global __topology_map
+    __topology_map = __index_map(topology_map)
+    if verbose:
+        print_map()
+
+# the ip of the node with the index, 10.0.0.1 for the index 1
+def node_ip(index):
+    return '10.' + str((index >> 16) & 255) + '.' + str((index >> 8) & 255) + '.' + str(index & 255)
+
+# links: iterable of tuple(index1, index2, cost) with the indexes starting from 1
+def __new_map(count, links):
+    return {
+        'nodes': [{'index': index, 'ip': node_ip(index)} for index in range(1, count + 1)],
+        'links': [{'link': [index1, index2], 'cost': cost} for index1, index2, cost in links]}
+
+# a rows x cols grid, every node is linked to its right and lower neighbors
+def generate_grid(rows, cols, max_cost=10, seed=None):
+    rand = random.Random(seed)
+    links = []
+    for row in range(rows):
+        for col in range(cols):
+            index = row * cols + col + 1
+            if col + 1 < cols:
+                links.append((index, index + 1, rand.randint(1, max_cost)))
+            if row + 1 < rows:
+                links.append((index, index + cols, rand.randint(1, max_cost)))
+    return __new_map(rows * cols, links)
+
+# nodes placed randomly in the unit square, linked if their distance is within the radius.
+# the cost is the distance scaled to max_cost. the default radius keeps the graph connected
+# with high probability.
+def generate_random_geometric(count, radius=None, max_cost=10, seed=None):
+    rand = random.Random(seed)
+    if radius is None:
+        radius = min(1.0, 1.5 * math.sqrt(math.log(max(count, 2)) / (math.pi * count)))
+    points = [(rand.random(), rand.random()) for _ in range(count)]
+    cells = {} # the nodes bucketed by cells of the radius size
+    for index, (x, y) in enumerate(points, 1):
+        cells.setdefault((int(x / radius), int(y / radius)), []).append(index)
+    links = []
+    for (cx, cy), indexes in cells.items():
+        for index1 in indexes:
+            x1, y1 = points[index1 - 1]
+            for dx, dy in itertools.product((-1, 0, 1), repeat=2):
+                for index2 in cells.get((cx + dx, cy + dy), ()):
+                    if index2 <= index1:
+                        continue
+                    x2, y2 = points[index2 - 1]
+                    distance = math.hypot(x1 - x2, y1 - y2)
+                    if distance <= radius:
+                        links.append((index1, index2, max(1, math.ceil(distance / radius * max_cost))))
+    return __new_map(count, links)
+
+# the switches of a k-ary fat tree: (k/2)² core switches, and k pods of k/2
+# aggregation and k/2 edge switches. all the links cost 1.
+def generate_fat_tree(k):
+    half = k // 2
+    cores = half * half
+    links = []
+    for pod in range(k):
+        aggregation = cores + pod * k + 1
+        edge = aggregation + half
+        for a in range(half):
+            for c in range(half):
+                links.append((a * half + c + 1, aggregation + a, 1))
+            for e in range(half):
+                links.append((aggregation + a, edge + e, 1))
+    return __new_map(cores + k * k, links)
+
+# a scale free graph grown by preferential attachment, every new node is linked
+# to m existing nodes chosen with the probability proportional to their degree
+def generate_barabasi_albert(count, m=2, max_cost=10, seed=None):
+    rand = random.Random(seed)
+    links = []
+    degrees = [] # every node appears once per link end
+    for index in range(1, min(count, m + 1) + 1):
+        for other in range(1, index):
+            links.append((other, index, rand.randint(1, max_cost)))
+            degrees += [other, index]
+    for index in range(m + 2, count + 1):
+        targets = set()
+        while len(targets) < m:
+            targets.add(rand.choice(degrees))
+        for target in targets:
+            links.append((target, index, rand.randint(1, max_cost)))
+            degrees += [target, index]
+    return __new_map(count, links)
+
+def __square_grid(size, seed):
+    rows = max(1, int(math.sqrt(size)))
+    return generate_grid(rows, max(1, round(size / rows)), seed=seed)
+
+# key: the name of the generator; value: function(size, seed) returning the map of about size nodes
+Generators = {
+    'grid': __square_grid,
+    'geometric': lambda size, seed: generate_random_geometric(size, seed=seed),
+    'fattree': lambda size, seed: generate_fat_tree(max(2, 2 * round(math.sqrt(size / 5)))),
+    'barabasi': lambda size, seed: generate_barabasi_albert(size, seed=seed),
+}
+
 def static_edges():
-    edges = set() # set of frozenset
-    for link in __topology_map.links:
-        indexes = link.link
-        ips = []
-        for index in indexes:
-            node = next((node for node in __topology_map.nodes if node.index == index), None)
-            if node is not None:
-                ips.append(node.ip)
-            else:
-                break
-        if len(ips) == 2:
-            edges.add(frozenset(ips))
-    return frozenset(edges)
+    return __topology_map.Edges()
+
+# the ips of all the nodes in the order of the config file
+def node_ips():
+    return [node.ip for node in __topology_map.nodes]
 
 def node_identifier(ip):
-    node = next((node for node in __topology_map.nodes if (node.ip == ip)), None)
-    if node is not None:
-        return node.index
-    else:
-        return -1
+    return __topology_map.ip_to_index.get(ip, -1)
 
 # return a set of namedtuple(['TargetIp', 'Cost'])
 def static_adjacents(src):
-    srcnode = next((node for node in __topology_map.nodes if(node.ip == src)), None)
-    if(srcnode is None):
+    index = __topology_map.ip_to_index.get(src, None)
+    if index is None:
         return []
-    IndexAdjacent = namedtuple('IndexAdjacent', ['index', 'cost'])
-    adjacents = map(lambda link: IndexAdjacent(
-        index=next(index for index in link.link if index != srcnode.index)
-        , cost=link.cost)
-        , [link for link in __topology_map.links if(srcnode.index in link.link)])
-    AdjacentState = namedtuple('AdjacentState', ['TargetIp', 'Cost'])
-    return set(map(lambda adjacent: AdjacentState(
-        TargetIp = next(node for node in __topology_map.nodes if node.index==adjacent.index).ip,
-        Cost = adjacent.cost)
-        , adjacents))
+    return set(AdjacentState(TargetIp=__topology_map.index_to_ip[adjacent], Cost=cost)
+        for adjacent, cost in __topology_map.adjacents[index].items()
+        if adjacent in __topology_map.index_to_ip)
 
 def is_adjacent(src, dest):
-    (srcnode,  destnode)= next((
-        (node1, node2) 
-        for node1 in __topology_map.nodes if(node1.ip == src) 
-        for node2 in __topology_map.nodes if(node2.ip == dest))
-        , (None, None))
-    if srcnode is None or destnode is None:
+    srcindex = __topology_map.ip_to_index.get(src, None)
+    destindex = __topology_map.ip_to_index.get(dest, None)
+    if srcindex is None or destindex is None:
         return False
-
-    return any(link for link in __topology_map.links 
-    if(frozenset((srcnode.index, destnode.index)) == frozenset(link.link)))
+    return destindex in __topology_map.adjacents[srcindex]
 
 if __name__ == "__main__":
     create_map()
     for node in __topology_map.nodes:
         print("srouce:", node.ip, "adjacents:"
         , ",".join(list(map(lambda adj: "(" + adj.TargetIp + "-" + str(adj.Cost) + ")", static_adjacents(node.ip)))))
-    for link in __topology_map.links:
+    for link in __topology_map.Links():
         print(link.link[0], link.link[1], link.cost, sep="-")
 
     print(is_adjacent("10.0.0.1", "10.0.0.7"))
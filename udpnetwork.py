@@ -0,0 +1,111 @@
+import selectors
+import socket
+import threading
+from networkinterface import NetworkInterface
+from messages import Unicast, Broadcast
+import metrics
+import wireformat
+
+MaxDatagramSize = 65507 # the largest udp payload over ipv4
+
+# the network interface carrying the messages as udp datagrams on the loopback.
+# every router has its own socket, the messages are encoded by wireformat and
+# a broadcast is sent as one datagram to every destination. the links which
+# are down are checked on delivery the same as NetworkInterface.
+class UdpNetworkInterface(NetworkInterface):
+    # edges: frozenset of edges which is a frozenset of the two adjacent nodes
+    # host: the address the sockets are bound to
+    # raise ValueError if a broadcast of the topology may not fit in a datagram
+    def __init__(self, edges:frozenset, host='127.0.0.1'):
+        degrees = {} # key: ip; value: number of the links of the node
+        for edge in edges:
+            for ip in edge:
+                degrees[ip] = degrees.get(ip, 0) + 1
+        # a broadcast is sent to the adjacents of a node with the advertisement of any node
+        degree = max(degrees.values(), default=0)
+        if wireformat.BroadcastSize(degree, degree) > MaxDatagramSize:
+            raise ValueError('a node of ' + str(degree) + ' links exceeds the udp datagram of '
+                + str(MaxDatagramSize) + ' bytes')
+        NetworkInterface.__init__(self, edges)
+        self.__host = host
+        self.__ips = [] # the ips of the registered routers
+        self.__sockets = {} # key: ip; value: the socket of the router
+        self.__addresses = {} # key: ip; value: the address of the socket of the router
+        self.__selector = None
+        self.__receiver = None
+        self.DecodeErrors = 0 # the datagrams dropped as not a message
+        self.SendErrors = 0 # the datagrams failed to be sent
+
+    def register(self, router):
+        NetworkInterface.register(self, router)
+        self.__ips.append(router.ip)
+
+    def open(self):
+        self.__selector = selectors.DefaultSelector()
+        for ip in self.__ips:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.__host, 0))
+            sock.setblocking(False)
+            self.__sockets[ip] = sock
+            self.__addresses[ip] = sock.getsockname()
+            self.__selector.register(sock, selectors.EVENT_READ, ip)
+        self._is_opened = True
+        self.__receiver = threading.Thread(target=self.__receive_messages)
+        self.__receiver.daemon = True
+        self.__receiver.start()
+
+    def close(self):
+        self._is_opened = False
+        if self.__receiver is not None:
+            self.__receiver.join()
+            self.__receiver = None
+        for sock in self.__sockets.values():
+            self.__selector.unregister(sock)
+            sock.close()
+        self.__sockets = {}
+        self.__selector.close()
+
+    def __receive_messages(self):
+        while self._is_opened:
+            for key, _ in self.__selector.select(0.1): # timeout 100ms
+                while True:
+                    try:
+                        data = key.fileobj.recv(65535)
+                    except BlockingIOError:
+                        break
+                    try:
+                        message = wireformat.Decode(data)
+                    except ValueError:
+                        self.DecodeErrors += 1
+                        if metrics.Instance.Enabled:
+                            metrics.Instance.Counter('udp.decode_errors', key.data).Add()
+                        continue
+                    if isinstance(message, Broadcast):
+                        # only the router of the socket receives the datagram
+                        message = Broadcast(message.src, (key.data,), message.payload, message.orgin)
+                    self.deliver(message)
+
+    def __send(self, src, dest, data):
+        sock = self.__sockets.get(src, None)
+        address = self.__addresses.get(dest, None)
+        if sock is None or address is None:
+            return
+        try:
+            sock.sendto(data, address)
+        except OSError:
+            # a lost datagram is recovered by the hellos and the refreshes
+            self.SendErrors += 1
+            if metrics.Instance.Enabled:
+                metrics.Instance.Counter('udp.send_errors', src).Add()
+
+    def sendto(self, msg:Unicast):
+        self._check_open()
+        if self.IsLinkUp(msg.src, msg.dest):
+            self.__send(msg.src, msg.dest, wireformat.Encode(msg))
+
+    def broadcast(self, message:Broadcast):
+        self._check_open()
+        data = wireformat.Encode(message)
+        for ip in message.dests:
+            if self.IsLinkUp(message.src, ip):
+                self.__send(message.src, ip, data)
@@ -0,0 +1,114 @@
+import socket
+import struct
+from messages import Ping, Pong, Broadcast, NodeAdjacentsDatabase
+from topology import AdjacentState
+
+# the binary encoding of the messages, in network byte order. the ips are packed
+# as 4 bytes ipv4 addresses, which are also the ids of the nodes.
+#
+# header:         version (B), type (B)
+# Ping, Pong:     header, src (4s), dest (4s)
+# Broadcast:      header, orgin (4s), src (4s), number of dests (H), dests (4s each),
+#                 advertisement
+# advertisement:  node ip (4s), sequence (I), age (d), number of adjacents (H),
+#                 adjacents (target ip (4s), cost (d) each)
+
+Version = 1
+
+TypePing = 1
+TypePong = 2
+TypeBroadcast = 3
+
+__header = struct.Struct('!BB')
+__unicast = struct.Struct('!BB4s4s')
+__broadcast = struct.Struct('!BB4s4sH')
+__ip = struct.Struct('!4s')
+__advertisement = struct.Struct('!4sIdH')
+__adjacent = struct.Struct('!4sd')
+
+__packed_ips = {} # key: ip; value: the packed ip
+__ips = {} # key: the packed ip; value: ip
+
+# return the 4 bytes of the ip, cached per ip
+def PackIp(ip):
+    packed = __packed_ips.get(ip, None)
+    if packed is None:
+        packed = __packed_ips.setdefault(ip, socket.inet_aton(ip))
+    return packed
+
+# return the ip of the 4 bytes, the ips are shared across the decoded messages
+def UnpackIp(packed):
+    ip = __ips.get(packed, None)
+    if ip is None:
+        packed = bytes(packed)
+        ip = __ips.setdefault(packed, socket.inet_ntoa(packed))
+    return ip
+
+# the costs are sent as double, the integral ones are restored as int
+def DecodeCost(value):
+    return int(value) if value.is_integer() else value
+
+# return the bytes of the message
+def Encode(message):
+    if isinstance(message, Ping) or isinstance(message, Pong):
+        return __unicast.pack(Version, TypePing if isinstance(message, Ping) else TypePong
+            , PackIp(message.src), PackIp(message.dest))
+    if isinstance(message, Broadcast):
+        dests = list(message.dests)
+        parts = [__broadcast.pack(Version, TypeBroadcast, PackIp(message.orgin), PackIp(message.src), len(dests))]
+        parts.extend(PackIp(ip) for ip in dests)
+        parts.append(EncodeAdvertisement(message.payload))
+        return b''.join(parts)
+    raise ValueError("unsupported message '" + type(message).__name__ + "'")
+
+def EncodeAdvertisement(payload:NodeAdjacentsDatabase):
+    parts = [__advertisement.pack(PackIp(payload.NodeIp), payload.Sequence, payload.Age, len(payload.Adjacents))]
+    parts.extend(__adjacent.pack(PackIp(state.TargetIp), state.Cost) for state in payload.Adjacents)
+    return b''.join(parts)
+
+# return the message decoded from the buffer, the fields are read through
+# a memoryview without copying the buffer.
+# raise ValueError if the buffer is not a message of this version
+def Decode(buffer):
+    view = memoryview(buffer)
+    try:
+        version, kind = __header.unpack_from(view, 0)
+        if version != Version:
+            raise ValueError('unsupported wire format version ' + str(version))
+        if kind == TypePing or kind == TypePong:
+            _, _, src, dest = __unicast.unpack_from(view, 0)
+            return (Ping if kind == TypePing else Pong)(UnpackIp(src), UnpackIp(dest))
+        if kind == TypeBroadcast:
+            _, _, orgin, src, count = __broadcast.unpack_from(view, 0)
+            offset = __broadcast.size
+            dests = set()
+            for _ in range(count):
+                dests.add(UnpackIp(__ip.unpack_from(view, offset)[0]))
+                offset += __ip.size
+            payload, offset = DecodeAdvertisement(view, offset)
+            return Broadcast(UnpackIp(src), dests, payload, UnpackIp(orgin))
+        raise ValueError('unknown message type ' + str(kind))
+    except struct.error as e:
+        raise ValueError('truncated message: ' + str(e)) from None
+
+# return tuple(NodeAdjacentsDatabase, the offset after it)
+def DecodeAdvertisement(buffer, offset=0):
+    view = memoryview(buffer)
+    node_ip, sequence, age, count = __advertisement.unpack_from(view, offset)
+    offset += __advertisement.size
+    adjacents = []
+    for _ in range(count):
+        target, cost = __adjacent.unpack_from(view, offset)
+        adjacents.append(AdjacentState(TargetIp=UnpackIp(target), Cost=DecodeCost(cost)))
+        offset += __adjacent.size
+    return NodeAdjacentsDatabase(UnpackIp(node_ip), adjacents, sequence, DecodeCost(age)), offset
+
+# return the number of the bytes of the encoded message
+def EncodedSize(message):
+    if isinstance(message, Broadcast):
+        return BroadcastSize(len(message.dests), len(message.payload.Adjacents))
+    return __unicast.size
+
+# return the number of the bytes of a broadcast to the dests of an advertisement of the adjacents
+def BroadcastSize(dests:int, adjacents:int):
+    return __broadcast.size + __ip.size * dests + __advertisement.size + __adjacent.size * adjacents